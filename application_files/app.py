@@ -1,16 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+import itertools
+import json
 import logging
+import os
 import time
 from  create_application_service import *
 from get_deployment_info_service import *
-from prometheus_client import Counter, Histogram, Summary, start_http_server,make_wsgi_app
-from kubernetes import client, config
+from prometheus_client import Counter, Histogram, Summary, start_http_server,make_wsgi_app, CollectorRegistry, REGISTRY, multiprocess
+from kubernetes import client
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 import create_predefined
+import kube_client
+import profiling
+import projection
+from jobs import job_queue
+from response_cache import make_etag, response_cache
+from rollout import ROLLOUT_MAX_WAITERS, ROLLOUT_WAIT_MAX_SECONDS, rollout_tracker, rollout_waiters
+from singleflight import SingleFlight
+
+def metrics_registry():
+    # Under gunicorn every worker keeps its own metrics, collect them all from the shared directory
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
 
 app = Flask(__name__)
 app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
-    '/metrics': make_wsgi_app()
+    '/metrics': make_wsgi_app(metrics_registry())
 })
 
 logging.basicConfig(level=logging.INFO)
@@ -20,28 +38,138 @@ logger = logging.getLogger(__name__)
 REQUEST_COUNT = Counter('flask_request_count', 'Total request count', ['method', 'endpoint', 'http_status'])
 REQUEST_LATENCY = Histogram('flask_request_latency_seconds', 'Request latency', ['endpoint'])
 REQUEST_LATENCY_SUMMARY = Summary('flask_request_latency_summary_seconds', 'Request latency summary', ['endpoint'])
+REQUEST_KUBE_API_CALLS = Histogram('flask_request_kube_api_calls', 'Kubernetes API calls made while serving a request', ['endpoint'],
+                                   buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
 DATABASE_ERRORS = Counter('database_errors', 'Total database errors')
 
-# Load Kubernetes configuration
-try:
-    config.load_incluster_config()  # If running within a Kubernetes cluster
-except config.config_exception.ConfigException:
-    config.load_kube_config()  # Load default kubeconfig if outside cluster
+# What /create_application returns unless ?fields= asks for more (or fields=* for the whole Deployment)
+CREATE_RESPONSE_FIELDS = ["metadata.name", "metadata.namespace", "metadata.uid", "metadata.resource_version",
+                          "metadata.creation_timestamp", "spec.replicas"]
+
+# Most applications one /create_applications request may create, each costs several API calls
+MAX_BULK_APPS = int(os.environ.get("MAX_BULK_APPS", "100"))
+
+def wait_arguments():
+    """Parse ?wait=true&timeout=<seconds>; the timeout defaults to, and is capped at, ROLLOUT_WAIT_MAX_SECONDS."""
+    wait = request.args.get('wait', 'false').lower() == 'true'
+    try:
+        timeout = float(request.args.get('timeout', ROLLOUT_WAIT_MAX_SECONDS))
+    except ValueError:
+        raise ValueError("'timeout' must be a number of seconds")
+    if timeout < 0:
+        raise ValueError("'timeout' must not be negative")
+    return wait, timeout
+
+def busy_response(key, message):
+    return jsonify({key: message}), 503, {'Retry-After': '5'}
+
+WAITERS_BUSY = f"Too many requests (ROLLOUT_MAX_WAITERS={ROLLOUT_MAX_WAITERS}) are waiting for rollouts, retry later or without wait=true"
+WATCHES_BUSY = "Too many rollouts are being followed outside the watch cache, retry later"
 
 # Define a route to create the Kubernetes application
 @app.route('/create_application', methods=['POST'])
 def create_kubernetes_application():
+    fields = request.args.get('fields')
+    if fields != '*':
+        fields = projection.parse_fields(fields) or CREATE_RESPONSE_FIELDS
+        try:
+            projection.check_fields(client.V1Deployment, fields)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+
+    try:
+        wait, timeout = wait_arguments()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    # Refused before anything is created, so the client can simply retry
+    if wait and not rollout_waiters.acquire(blocking=False):
+        return busy_response("message", WAITERS_BUSY)
+
     try:
         app_data = request.get_json()
         response = create_application(app_data)
 
         if response:
-            return jsonify({"message": "Deployment created successfully", "data": response.to_dict()}), 201
+            data = response.to_dict() if fields == '*' else projection.project_model(response, fields)
+            # Follow the rollout on the namespace watch instead of having the client poll /deployment_status.
+            # None if too many rollouts are followed already, /rollouts can pick it up later.
+            rollout = rollout_tracker.track(response.metadata.name, response.metadata.namespace, observe=True)
+            if wait and rollout is not None:
+                rollout.wait(timeout)
+            return jsonify({"message": "Deployment created successfully", "data": data,
+                            "rollout": rollout.to_dict() if rollout is not None else None,
+                            "rollout_url": f"/rollouts/{response.metadata.name}?namespace={response.metadata.namespace}"}), 201
         else:
             return jsonify({"message": "Failed to create Deployment"}), 500
 
     except Exception as e:
         return jsonify({"message": f"Error creating deployment: {str(e)}"}), 500
+    finally:
+        if wait:
+            rollout_waiters.release()
+
+@app.route('/create_applications', methods=['POST'])
+def create_kubernetes_applications():
+    apps_data = request.get_json(silent=True)
+    if not isinstance(apps_data, list):
+        return jsonify({"message": "Expected a JSON list of application specs"}), 400
+    if len(apps_data) > MAX_BULK_APPS:
+        return jsonify({"message": f"At most {MAX_BULK_APPS} applications per request"}), 400
+
+    try:
+        results = create_applications(apps_data)
+    except Exception as e:
+        return jsonify({"message": f"Error creating applications: {str(e)}"}), 500
+
+    data = [{
+        "AppName": result["AppName"],
+        "Success": result["Success"],
+        "Error": result["Error"],
+        "Resources": [{"Kind": r["Kind"], "Name": r["Name"], "Error": r["Error"]} for r in result["Resources"]],
+    } for result in results]
+    # 207: some apps may have failed while others were created
+    status = 201 if all(result["Success"] for result in results) else 207
+    return jsonify({"message": f"Created {sum(r['Success'] for r in results)} of {len(results)} applications", "data": data}), status
+
+# Pollers that miss the response cache together wait for one body instead of each building it
+response_builds = SingleFlight("response")
+
+def build_cached_body(etag, build):
+    # versions were read first, so the body is never older than its ETag
+    body = jsonify(build()).get_data()
+    response_cache.put(etag, body)
+    return body
+
+def api_error_response(e):
+    if e.status == 429:
+        # Over our own or the API server's rate limit, the caller should come back shortly
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    return jsonify({"error": str(e)}), 500
+
+def conditional_json(key, versions, build):
+    """Return ``build()`` as JSON with an ETag, answering a matching If-None-Match with 304.
+
+    When the resourceVersions behind the response are known the ETag comes
+    from them, before anything is built: an unchanged poll gets its 304, or
+    its body from ``response_cache``, without building or serializing.
+    Otherwise the ETag is a hash of the body, which still saves the download.
+    """
+    if versions is None:
+        response = jsonify(build())
+        response.add_etag()
+    else:
+        etag = make_etag(key, versions)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            body = response_cache.get(etag)
+            if body is None:
+                body = response_builds.do(etag, lambda: build_cached_body(etag, build))
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+    # Pollers may keep the response but must revalidate it every time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/deployment_status', methods=['GET'])
 def deployment_status():
@@ -52,31 +180,61 @@ def deployment_status():
         return jsonify({"error": "Missing 'app_name' parameter"}), 400
 
     try:
-        result = get_deployment_status_and_pods(app_name, namespace)
-        return jsonify(result)
+        fields = parse_status_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return conditional_json(('/deployment_status', namespace, app_name, fields),
+                                status_versions(namespace, app_name),
+                                lambda: get_deployment_status_and_pods(app_name, namespace, fields))
     except client.exceptions.ApiException as e:
-        return jsonify({"error": str(e)}), 500
+        return api_error_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+STREAM_PAGE_SIZE = int(os.environ.get("STREAM_PAGE_SIZE", "100"))
+
 @app.route('/all_applications', methods=['GET'])
 def all_applications():
     namespace = request.args.get('namespace', 'default')
+    continue_token = request.args.get('continue')
+    stream = request.args.get('stream', 'false').lower() == 'true' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer"}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "'limit' must be positive"}), 400
+
+    try:
+        # e.g. fields=DeploymentName,ReadyReplicas skips listing pods entirely
+        fields = parse_status_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        apps_v1_api = client.AppsV1Api()
-        deployments = apps_v1_api.list_namespaced_deployment(namespace=namespace)
+        if stream:
+            # One JSON document per line, written as soon as each deployment's status is built
+            statuses = iter_deployment_statuses(namespace, limit or STREAM_PAGE_SIZE, continue_token, fields)
+            # Build the first status before answering so API errors still get a proper error response
+            first = next(statuses, None)
+            lines = (json.dumps(status) + "\n" for status in itertools.chain([first] if first else [], statuses))
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
 
-        all_deployment_statuses = []
-        for deployment in deployments.items:
-            app_name = deployment.metadata.name
-            deployment_status = get_deployment_status_and_pods(namespace=namespace, app_name=app_name)
-            all_deployment_statuses.append(deployment_status)
+        if limit is not None or continue_token:
+            def build_page():
+                statuses, next_token = list_deployment_statuses_page(namespace, limit, continue_token, fields)
+                return {"items": statuses, "continue": next_token}
+            return conditional_json(None, None, build_page)
 
-        return jsonify(all_deployment_statuses)
+        return conditional_json(('/all_applications', namespace, fields), status_versions(namespace),
+                                lambda: get_all_deployment_statuses(namespace, fields))
 
     except client.exceptions.ApiException as e:
-        return jsonify({"error": str(e)}), 500
+        return api_error_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -88,65 +246,105 @@ def deploy_predefined_application():
         resources = app_data.get('Resources', {})
         external = app_data.get('External', False)
 
+        if not app_name:
+            return jsonify({"message": "Missing 'AppName'"}), 400
+
         secret_name = f"{app_name}-secret"
         secret_data = {
             'username': 'saraida',
             'password': 'saraida'
         }
-        create_predefined.create_or_update_secret(secret_name, secret_data)
 
         postgres_config = {
             'shared_buffers': '128MB',
             'max_connections': '100'
         }
         config_map_name = f"{app_name}-postgres-config"
-        create_predefined.create_or_update_config_map(config_map_name, postgres_config)
 
         service_type = 'LoadBalancer' if external else 'ClusterIP'
         service_name = f"{app_name}-service"
 
-        retry_attempts = 5
-        for attempt in range(retry_attempts):
-            try:
-                create_predefined.create_or_update_service(service_name, service_type, app_name)
-                break
-            except client.exceptions.ApiException as e:
-                if e.status == 500:
-                    if attempt < retry_attempts - 1:
-                        logger.warning(f"Service creation failed (attempt {attempt+1}/{retry_attempts}): {e}")
-                        time.sleep(5)
-                    else:
-                        raise e
-                else:
-                    raise e
-
-        create_predefined.create_or_update_deployment(app_name, secret_name, config_map_name, resources)
-
-        return jsonify({"message": f"Deployed predefined app {app_name} successfully"}), 201
+        # Steps run in order on a job worker, each retried with backoff on transient errors
+        job = job_queue.submit(f"deploy-predefined-app {app_name}", [
+            ("secret", lambda: create_predefined.create_or_update_secret(secret_name, secret_data)),
+            ("configmap", lambda: create_predefined.create_or_update_config_map(config_map_name, postgres_config)),
+            ("service", lambda: create_predefined.create_or_update_service(service_name, service_type, app_name)),
+            ("deployment", lambda: create_predefined.create_or_update_deployment(app_name, secret_name, config_map_name, resources)),
+        ])
+
+        response = jsonify({
+            "message": f"Deployment of predefined app {app_name} accepted",
+            "job_id": job.id,
+            "status_url": f"/jobs/{job.id}"
+        })
+        response.headers['Location'] = f"/jobs/{job.id}"
+        return response, 202
 
-    except client.exceptions.ApiException as e:
-        logger.error(f"Kubernetes API error: {e}")
-        return jsonify({"message": f"Error: {str(e)}"}), 500
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         return jsonify({"message": f"Error: {str(e)}"}), 500
 
+@app.route('/rollouts/<string:deployment_name>', methods=['GET'])
+def rollout_status(deployment_name):
+    namespace = request.args.get('namespace', 'default')
+    try:
+        wait, timeout = wait_arguments()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rollout = rollout_tracker.get(deployment_name, namespace)
+    if rollout is None:
+        try:
+            # Only start tracking Deployments that exist, not every name anyone asks about
+            kube_client.apps_v1().read_namespaced_deployment(name=deployment_name, namespace=namespace)
+        except client.exceptions.ApiException as e:
+            if e.status == 404:
+                return jsonify({"error": f"Deployment '{deployment_name}' not found"}), 404
+            return jsonify({"error": str(e)}), 500
+        rollout = rollout_tracker.track(deployment_name, namespace)
+        if rollout is None:
+            return busy_response("error", WATCHES_BUSY)
+    if wait and not rollout.done.is_set():
+        if not rollout_waiters.acquire(blocking=False):
+            return busy_response("error", WAITERS_BUSY)
+        try:
+            rollout.wait(timeout)
+        finally:
+            rollout_waiters.release()
+    return jsonify(rollout.to_dict()), 200
+
+@app.route('/jobs/<string:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job), 200
+
 @app.before_request
 def before_request():
     request.start_time = time.time()
+    request.kube_api_calls = kube_client.track_api_calls()
 
 @app.after_request
 def after_request(response):
     request_latency = time.time() - request.start_time
-    REQUEST_COUNT.labels(request.method, request.path, response.status_code).inc()
-    REQUEST_LATENCY.labels(request.path).observe(request_latency)
-    REQUEST_LATENCY_SUMMARY.labels(request.path).observe(request_latency)
+    # Label by route template ('/jobs/<string:job_id>'), not the raw path, to keep cardinality bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_COUNT.labels(request.method, endpoint, response.status_code).inc()
+    REQUEST_LATENCY.labels(endpoint).observe(request_latency)
+    REQUEST_LATENCY_SUMMARY.labels(endpoint).observe(request_latency)
+    REQUEST_KUBE_API_CALLS.labels(endpoint).observe(request.kube_api_calls[0])
+    response.headers['X-Kube-API-Calls'] = str(request.kube_api_calls[0])
     return response
 
+# Per-request profiles and /debug/profiler, only with PROFILING_ENABLED=true.
+# Installed after the hooks above so a refused /debug request still gets its start_time.
+profiling.install(app)
+
 @app.route('/metrics', methods=['GET'])
 def metrics():
     from prometheus_client import generate_latest
-    return generate_latest()
+    return generate_latest(metrics_registry())
 @app.route('/healthz', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"}), 200
@@ -156,5 +354,6 @@ def health_check():
 #     return jsonify({"status": "healthy"}), 200
 
 if __name__ == '__main__':
+    # Development server only, production runs: gunicorn -c gunicorn.conf.py app:app
     # start_http_server(8001)  # Start Prometheus metrics exporter
     app.run(debug=True,host='0.0.0.0', port=4040)
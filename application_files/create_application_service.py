@@ -1,148 +1,199 @@
-from kubernetes import client, config
+from kubernetes import client
 from kubernetes.client.rest import ApiException
+from reconcile import server_side_apply
+import kube_client
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import datetime
 import base64
+import os
 import random
 import string
 
-config.load_incluster_config()
-# print(config.list_kube_config_contexts())
+APPLY_WORKERS = int(os.environ.get("APPLY_WORKERS", "16"))
 
-# Kubernetes API clients
-apps_v1_api = client.AppsV1Api()
-core_v1_api = client.CoreV1Api()
-networking_v1_api = client.NetworkingV1Api()
+# Shared by every request so the number of concurrent API calls stays bounded
+apply_pool = ThreadPoolExecutor(max_workers=APPLY_WORKERS, thread_name_prefix="apply")
 
 def create_application(app_data):
-    try:
-        app_name = app_data["AppName"]
-        replicas = app_data.get("Replicas", 1)
-        image_address = app_data["ImageAddress"]
-        image_tag = app_data.get("ImageTag", "latest")
-        cpu_request = app_data["Resources"]["CPU"]
-        ram_request = app_data["Resources"]["RAM"]
-        envs = app_data.get("Envs", [])
-
-        print(f"Creating application '{app_name}'...")
-        
-        # Handle secrets
-        secrets = []
-        for env in envs:
-            if env.get("IsSecret", False):
-                secret_name = f"{app_name.lower()}-secret-{generate_random_name()}"
-                secret_data = {env["Key"]: base64.b64encode(env["Value"].encode()).decode()}  # Encode the secret data
-                secret = client.V1Secret(
-                    api_version="v1",
-                    kind="Secret",
-                    metadata=client.V1ObjectMeta(name=secret_name),
-                    data=secret_data
-                )
-                secrets.append(secret)
-                # Create the secret
-                try:
-                    core_v1_api.create_namespaced_secret(namespace="default", body=secret)
-                    print(f"Secret '{secret_name}' created.")
-                except ApiException as e:
-                    if e.status == 409:
-                        print(f"Secret '{secret_name}' already exists.")
-                    else:
-                        raise
-
-        # Generate a unique deployment name
-        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        deployment_name = f"{app_name.lower()}-deployment-{timestamp}"
-
-        print(f"Creating deployment '{deployment_name}'...")
-        
-        # Define container specification
-        container = client.V1Container(
-            name=app_name.lower(),
-            image=f"{image_address}:{image_tag}",
-            resources=client.V1ResourceRequirements(
-                requests={"cpu": cpu_request, "memory": ram_request}
-            ),
-            env=[client.V1EnvVar(name=env["Key"], value_from=client.V1EnvVarSource(secret_key_ref=client.V1SecretKeySelector(name=secret.metadata.name, key=env["Key"]))) if env.get("IsSecret", False) else client.V1EnvVar(name=env["Key"], value=env["Value"]) for env in envs]
+    result = create_applications([app_data])[0]
+    if not result["Success"]:
+        print(f"Exception when creating application: {result['Error']}")
+        return None
+    for resource in result["Resources"]:
+        if resource["Kind"] == "Deployment":
+            return resource["Response"]
+
+def create_applications(apps_data):
+    """Create many applications, applying their independent resources concurrently.
+
+    The Secret, the Deployment, the Service and the optional Ingress of an app
+    don't depend on each other being created first (a pod just waits for its
+    secrets), so every resource of every app is submitted to ``apply_pool``
+    at once.  Returns one result per app, in order; a failure only marks that
+    app as failed.
+    """
+    planned = []
+    for app_data in apps_data:
+        try:
+            steps = plan_application(app_data)
+        except (KeyError, TypeError, AttributeError) as e:
+            planned.append((app_data, None, f"Invalid application spec: missing or invalid {e}"))
+            continue
+        print(f"Creating application '{app_data['AppName']}'...")
+        # Run in a copy of the request's context so its API calls are counted against it
+        futures = [(kind, name, apply_pool.submit(contextvars.copy_context().run, step)) for kind, name, step in steps]
+        planned.append((app_data, futures, None))
+
+    results = []
+    for app_data, futures, error in planned:
+        app_name = app_data.get("AppName") if isinstance(app_data, dict) else None
+        if futures is None:
+            results.append({"AppName": app_name, "Success": False, "Error": error, "Resources": []})
+            continue
+
+        resources = []
+        for kind, name, future in futures:
+            try:
+                response = future.result()
+                resources.append({"Kind": kind, "Name": name, "Error": None, "Response": response})
+            except Exception as e:
+                print(f"Exception when creating {kind} '{name}': {e}")
+                resources.append({"Kind": kind, "Name": name, "Error": str(e), "Response": None})
+        failed = [r for r in resources if r["Error"] is not None]
+        results.append({
+            "AppName": app_name,
+            "Success": not failed,
+            "Error": f"{len(failed)} of {len(resources)} resources failed" if failed else None,
+            "Resources": resources,
+        })
+    return results
+
+def plan_application(app_data):
+    """Build every resource of an app and return (kind, name, apply function) steps."""
+    app_name = app_data["AppName"]
+    replicas = app_data.get("Replicas", 1)
+    image_address = app_data["ImageAddress"]
+    image_tag = app_data.get("ImageTag", "latest")
+    cpu_request = app_data["Resources"]["CPU"]
+    ram_request = app_data["Resources"]["RAM"]
+    envs = app_data.get("Envs", [])
+
+    steps = []
+
+    # All secret env vars of the app live in one Secret with a stable name, so a
+    # redeploy updates it in place instead of leaving another one behind
+    secret_name = f"{app_name.lower()}-secrets"
+    secret_data = {env["Key"]: base64.b64encode(env["Value"].encode()).decode()  # Encode the secret data
+                   for env in envs if env.get("IsSecret", False)}
+    if secret_data:
+        secret = client.V1Secret(
+            api_version="v1",
+            kind="Secret",
+            metadata=client.V1ObjectMeta(name=secret_name),
+            data=secret_data
         )
+        steps.append(("Secret", secret_name, lambda: apply_secret(secret)))
+
+    # Generate a unique deployment name
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    deployment_name = f"{app_name.lower()}-deployment-{timestamp}"
+
+    # Define container specification
+    container = client.V1Container(
+        name=app_name.lower(),
+        image=f"{image_address}:{image_tag}",
+        resources=client.V1ResourceRequirements(
+            requests={"cpu": cpu_request, "memory": ram_request}
+        ),
+        env=[client.V1EnvVar(name=env["Key"], value_from=client.V1EnvVarSource(secret_key_ref=client.V1SecretKeySelector(name=secret_name, key=env["Key"]))) if env.get("IsSecret", False) else client.V1EnvVar(name=env["Key"], value=env["Value"]) for env in envs]
+    )
 
-        # Define deployment metadata
-        metadata = client.V1ObjectMeta(name=deployment_name)
-
-        # Define pod template specification
-        template = client.V1PodTemplateSpec(
-            metadata=client.V1ObjectMeta(labels={"app": app_name}),
-            spec=client.V1PodSpec(containers=[container]),
-        )
+    # Define deployment metadata
+    metadata = client.V1ObjectMeta(name=deployment_name)
 
-        # Define deployment specification
-        spec = client.V1DeploymentSpec(
-            replicas=replicas,
-            selector=client.V1LabelSelector(match_labels={"app": app_name}),
-            template=template
-        )
+    # Define pod template specification
+    template = client.V1PodTemplateSpec(
+        metadata=client.V1ObjectMeta(labels={"app": app_name}),
+        spec=client.V1PodSpec(containers=[container]),
+    )
 
-        # Define deployment object
-        deployment = client.V1Deployment(
-            api_version="apps/v1",
-            kind="Deployment",
-            metadata=metadata,
-            spec=spec
-        )
+    # Define deployment specification
+    spec = client.V1DeploymentSpec(
+        replicas=replicas,
+        selector=client.V1LabelSelector(match_labels={"app": app_name}),
+        template=template
+    )
 
-        # Create the deployment using Kubernetes API
-        deployment_response = apps_v1_api.create_namespaced_deployment(
-            body=deployment,
-            namespace="default"
-        )
+    # Define deployment object
+    deployment = client.V1Deployment(
+        api_version="apps/v1",
+        kind="Deployment",
+        metadata=metadata,
+        spec=spec
+    )
+    steps.append(("Deployment", deployment_name, lambda: create_deployment(deployment)))
 
-        print(f"Deployment '{deployment_name}' created successfully.")
-        
-        # Create the service
-        print(f"Creating service for '{app_name}'...")
-        create_service(app_data)
+    steps.append(("Service", app_name.lower(), lambda: create_service(app_data)))
 
+    # Optionally, create an Ingress object
+    if app_data.get("DomainAddress") and app_data.get("ServicePort"):
         # Generate a unique Ingress name
         ingress_name = f"{app_name.lower()}-ingress-{generate_random_name()}"
+        steps.append(("Ingress", ingress_name, lambda: create_ingress(ingress_name, app_data)))
+
+    return steps
+
+def apply_secret(secret):
+    server_side_apply(secret, kube_client.core_v1().patch_namespaced_secret)
+    print(f"Secret '{secret.metadata.name}' applied with {len(secret.data)} keys.")
+
+def create_deployment(deployment):
+    print(f"Creating deployment '{deployment.metadata.name}'...")
+
+    # Create the deployment using Kubernetes API
+    deployment_response = kube_client.apps_v1().create_namespaced_deployment(
+        body=deployment,
+        namespace="default"
+    )
 
-        # Optionally, create an Ingress object
-        if app_data.get("DomainAddress") and app_data.get("ServicePort"):
-            ingress_body = {
-                "apiVersion": "networking.k8s.io/v1",
-                "kind": "Ingress",
-                "metadata": {"name": ingress_name},
-                "spec": {
-                    "rules": [{
-                        "host": app_data["DomainAddress"],
-                        "http": {
-                            "paths": [{
-                                "path": "/",
-                                "pathType": "ImplementationSpecific",  # Specify a valid pathType
-                                "backend": {
-                                    "service": {
-                                        "name": app_name.lower(),
-                                        "port": {
-                                            "number": app_data["ServicePort"]
-                                        }
-                                    }
+    print(f"Deployment '{deployment.metadata.name}' created successfully.")
+    return deployment_response
+
+def create_ingress(ingress_name, app_data):
+    app_name = app_data["AppName"]
+    ingress_body = {
+        "apiVersion": "networking.k8s.io/v1",
+        "kind": "Ingress",
+        "metadata": {"name": ingress_name},
+        "spec": {
+            "rules": [{
+                "host": app_data["DomainAddress"],
+                "http": {
+                    "paths": [{
+                        "path": "/",
+                        "pathType": "ImplementationSpecific",  # Specify a valid pathType
+                        "backend": {
+                            "service": {
+                                "name": app_name.lower(),
+                                "port": {
+                                    "number": app_data["ServicePort"]
                                 }
-                            }]
+                            }
                         }
                     }]
                 }
-            }
-            try:
-                networking_v1_api.create_namespaced_ingress(namespace="default", body=ingress_body)
-                print(f"Ingress '{ingress_name}' created.")
-            except ApiException as e:
-                if e.status == 409:
-                    print(f"Ingress '{ingress_name}' already exists.")
-                else:
-                    raise
-
-        return deployment_response
-
+            }]
+        }
+    }
+    try:
+        kube_client.networking_v1().create_namespaced_ingress(namespace="default", body=ingress_body)
+        print(f"Ingress '{ingress_name}' created.")
     except ApiException as e:
-        print(f"Exception when creating Deployment: {e}")
-        return None
+        if e.status == 409:
+            print(f"Ingress '{ingress_name}' already exists.")
+        else:
+            raise
 
 def create_service(app_data):
     service = client.V1Service(
@@ -156,7 +207,7 @@ def create_service(app_data):
     )
 
     try:
-        api_response = core_v1_api.create_namespaced_service(
+        api_response = kube_client.core_v1().create_namespaced_service(
             namespace="default",
             body=service
         )
@@ -1,12 +1,8 @@
-from kubernetes import client, config
+from kubernetes import client
 import base64
 import logging
-# Load Kubernetes configuration
-config.load_incluster_config()
-
-
-core_v1_api = client.CoreV1Api()
-apps_v1_api = client.AppsV1Api()
+from reconcile import apply_resource
+import kube_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,14 +15,7 @@ def create_or_update_secret(secret_name, secret_data):
         metadata=client.V1ObjectMeta(name=secret_name),
         data={k: base64.b64encode(v.encode()).decode() for k, v in secret_data.items()}
     )
-    try:
-        core_v1_api.create_namespaced_secret(namespace='default', body=secret_body)
-    except client.exceptions.ApiException as e:
-        if e.status == 409:
-            logger.info(f"Secret {secret_name} already exists. Updating it.")
-            core_v1_api.patch_namespaced_secret(name=secret_name, namespace='default', body=secret_body)
-        else:
-            raise e
+    apply_resource(secret_body, kube_client.core_v1().read_namespaced_secret, kube_client.core_v1().patch_namespaced_secret)
 
 def create_or_update_config_map(config_map_name, config_data):
     config_map_body = client.V1ConfigMap(
@@ -35,14 +24,7 @@ def create_or_update_config_map(config_map_name, config_data):
         metadata=client.V1ObjectMeta(name=config_map_name),
         data=config_data
     )
-    try:
-        core_v1_api.create_namespaced_config_map(namespace='default', body=config_map_body)
-    except client.exceptions.ApiException as e:
-        if e.status == 409:
-            logger.info(f"ConfigMap {config_map_name} already exists. Updating it.")
-            core_v1_api.patch_namespaced_config_map(name=config_map_name, namespace='default', body=config_map_body)
-        else:
-            raise e
+    apply_resource(config_map_body, kube_client.core_v1().read_namespaced_config_map, kube_client.core_v1().patch_namespaced_config_map)
 
 def create_or_update_service(service_name, service_type, app_name):
     service_body = client.V1Service(
@@ -55,14 +37,7 @@ def create_or_update_service(service_name, service_type, app_name):
             selector={'app': app_name}
         )
     )
-    try:
-        core_v1_api.create_namespaced_service(namespace='default', body=service_body)
-    except client.exceptions.ApiException as e:
-        if e.status == 409:
-            logger.info(f"Service {service_name} already exists. Updating it.")
-            core_v1_api.patch_namespaced_service(name=service_name, namespace='default', body=service_body)
-        else:
-            raise e
+    apply_resource(service_body, kube_client.core_v1().read_namespaced_service, kube_client.core_v1().patch_namespaced_service)
 
 def create_or_update_deployment(app_name, secret_name, config_map_name, resources):
     container = client.V1Container(
@@ -132,12 +107,5 @@ def create_or_update_deployment(app_name, secret_name, config_map_name, resource
         spec=spec
     )
 
-    try:
-        apps_v1_api.create_namespaced_deployment(namespace='default', body=deployment_body)
-    except client.exceptions.ApiException as e:
-        if e.status == 409:
-            logger.info(f"Deployment {app_name}-deployment already exists. Updating it.")
-            apps_v1_api.patch_namespaced_deployment(name=f"{app_name}-deployment", namespace='default', body=deployment_body)
-        else:
-            raise e
+    apply_resource(deployment_body, kube_client.apps_v1().read_namespaced_deployment, kube_client.apps_v1().patch_namespaced_deployment)
 
@@ -1,40 +1,166 @@
-from kubernetes import client, config
+import kube_client
+import watch_cache
+from singleflight import SingleFlight
 
-def get_deployment_status_and_pods(app_name, namespace='default'):
-    # Load the kubeconfig from default location or in-cluster configuration
-    print(config.load_incluster_config()) #if running within a cluster
+# Identical status fetches running at the same time share one set of API calls
+status_fetches = SingleFlight("status")
 
-    # Create an API client for the AppsV1Api and CoreV1Api
-    apps_v1_api = client.AppsV1Api()
-    core_v1_api = client.CoreV1Api()
+def format_start_time(pod):
+    return pod.status.start_time.strftime("%Y-%m-%dT%H:%M:%SZ") if pod.status.start_time else ""
 
-    # Get the deployment
-    deployment = apps_v1_api.read_namespaced_deployment(name=app_name, namespace=namespace)
+# Everything a status response can contain, built only when asked for
+STATUS_FIELDS = {
+    "DeploymentName": lambda app_name, deployment: app_name,
+    "Replicas": lambda app_name, deployment: deployment.status.replicas,
+    "ReadyReplicas": lambda app_name, deployment: deployment.status.ready_replicas,
+}
+POD_FIELDS = {
+    "Name": lambda pod: pod.metadata.name,
+    "Phase": lambda pod: pod.status.phase,
+    "HostIP": lambda pod: pod.status.host_ip or "",
+    "PodIP": lambda pod: pod.status.pod_ip or "",
+    "StartTime": format_start_time,
+}
+
+def parse_status_fields(value):
+    """Parse a ``fields=`` value like ``DeploymentName,PodStatuses.Phase``.
+
+    Returns ``(status_fields, pod_fields)``; ``pod_fields`` is None when no
+    pod statuses were requested.  A missing parameter selects everything.
+    ``PodStatuses`` alone selects every pod field.
+    """
+    if not value:
+        return list(STATUS_FIELDS), list(POD_FIELDS)
+
+    status_fields, pod_fields = [], None
+    for field in filter(None, (f.strip() for f in value.split(","))):
+        name, _, pod_field = field.partition(".")
+        if name == "PodStatuses":
+            pod_fields = pod_fields or []
+            if not pod_field:
+                pod_fields.extend(f for f in POD_FIELDS if f not in pod_fields)
+            elif pod_field not in POD_FIELDS:
+                raise ValueError(f"Unknown pod field '{pod_field}', expected one of {', '.join(POD_FIELDS)}")
+            elif pod_field not in pod_fields:
+                pod_fields.append(pod_field)
+        elif name in STATUS_FIELDS and not pod_field:
+            if name not in status_fields:
+                status_fields.append(name)
+        else:
+            raise ValueError(f"Unknown field '{field}', expected one of {', '.join(STATUS_FIELDS)}, PodStatuses")
+    return status_fields, pod_fields
+
+ALL_FIELDS = parse_status_fields(None)
+
+def build_deployment_status(app_name, deployment, pods, fields=ALL_FIELDS):
+    status_fields, pod_fields = fields
+    deployment_status = {name: STATUS_FIELDS[name](app_name, deployment) for name in status_fields}
+
+    if pod_fields is not None:
+        deployment_status["PodStatuses"] = [
+            {name: POD_FIELDS[name](pod) for name in pod_fields}
+            for pod in pods
+        ]
+
+    return deployment_status
+
+def wants_pods(fields):
+    return fields[1] is not None
+
+def fields_key(fields):
+    status_fields, pod_fields = fields
+    return tuple(status_fields), tuple(pod_fields) if pod_fields is not None else None
+
+def get_deployment_status_and_pods(app_name, namespace='default', fields=ALL_FIELDS):
+    if watch_cache.enabled_for(namespace):
+        cache = watch_cache.get_cache(namespace)
+        deployment = cache.get_deployment(app_name)
+        if deployment is not None:
+            return build_deployment_status(app_name, deployment, cache.get_pods_for_deployment(app_name), fields)
+        # Not cached yet (e.g. just created and the watch event is still in flight),
+        # fall back to asking the API server directly
+
+    return status_fetches.do(("deployment", namespace, app_name, fields_key(fields)),
+                             lambda: fetch_deployment_status_and_pods(app_name, namespace, fields))
 
-    # Extract deployment status
-    deployment_status = {
-        "DeploymentName": app_name,
-        "Replicas": deployment.status.replicas,
-        "ReadyReplicas": deployment.status.ready_replicas,
-        "PodStatuses": []
-    }
+def status_versions(namespace='default', app_name=None):
+    """resourceVersions behind a status response for one app (or the whole namespace).
 
+    None when they can't be known without calling the API server, i.e. the
+    watch cache is off or doesn't have the deployment yet.
+    """
+    if not watch_cache.enabled_for(namespace):
+        return None
+    cache = watch_cache.get_cache(namespace)
+    if app_name is None:
+        return cache.versions()
+    if cache.get_deployment(app_name) is None:
+        return None
+    return cache.versions([app_name])
+
+def get_all_deployment_statuses(namespace='default', fields=ALL_FIELDS):
+    if watch_cache.enabled_for(namespace):
+        cache = watch_cache.get_cache(namespace)
+        return [
+            build_deployment_status(deployment.metadata.name, deployment,
+                                    cache.get_pods_for_deployment(deployment.metadata.name), fields)
+            for deployment in cache.list_deployments()
+        ]
+
+    def fetch():
+        deployments = kube_client.apps_v1().list_namespaced_deployment(namespace=namespace)
+        return [status_for_deployment(deployment, namespace, fields) for deployment in deployments.items]
+    return status_fetches.do(("all", namespace, fields_key(fields)), fetch)
+
+def list_deployment_statuses_page(namespace='default', limit=None, continue_token=None, fields=ALL_FIELDS):
+    """Return one page of deployment statuses and the continue token for the next page.
+
+    ``limit`` and ``continue_token`` are passed straight to the Kubernetes
+    list call, so tokens stay valid across pages the way the API server
+    defines them.  The token is None on the last page.
+    """
+    def fetch():
+        deployments = kube_client.apps_v1().list_namespaced_deployment(
+            namespace=namespace, limit=limit, _continue=continue_token)
+        statuses = [status_for_deployment(deployment, namespace, fields) for deployment in deployments.items]
+        return statuses, deployments.metadata._continue
+    return status_fetches.do(("page", namespace, limit, continue_token, fields_key(fields)), fetch)
+
+def iter_deployment_statuses(namespace='default', page_size=100, continue_token=None, fields=ALL_FIELDS):
+    """Yield deployment statuses one at a time, holding at most one page in memory."""
+    if watch_cache.enabled_for(namespace) and not continue_token:
+        cache = watch_cache.get_cache(namespace)
+        for deployment in cache.list_deployments():
+            yield build_deployment_status(deployment.metadata.name, deployment,
+                                          cache.get_pods_for_deployment(deployment.metadata.name), fields)
+        return
+
+    while True:
+        statuses, continue_token = list_deployment_statuses_page(namespace, page_size, continue_token, fields)
+        yield from statuses
+        if not continue_token:
+            return
+
+def status_for_deployment(deployment, namespace='default', fields=ALL_FIELDS):
+    app_name = deployment.metadata.name
+    if not wants_pods(fields):
+        # No pod statuses requested, don't list pods at all
+        return build_deployment_status(app_name, deployment, [], fields)
+    if watch_cache.enabled_for(namespace):
+        return build_deployment_status(app_name, deployment, watch_cache.get_cache(namespace).get_pods_for_deployment(app_name), fields)
+    return build_deployment_status(app_name, deployment, list_pods_for_deployment(deployment, namespace), fields)
+
+def list_pods_for_deployment(deployment, namespace='default'):
     # Get the selector labels from the deployment spec
     selector_labels = deployment.spec.selector.match_labels
     selector = ','.join([f"{key}={value}" for key, value in selector_labels.items()])
 
     # List the pods using the selector
-    pods = core_v1_api.list_namespaced_pod(namespace=namespace, label_selector=selector)
-
-    # Populate pod statuses
-    for pod in pods.items:
-        pod_status = {
-            "Name": pod.metadata.name,
-            "Phase": pod.status.phase,
-            "HostIP": pod.status.host_ip or "",
-            "PodIP": pod.status.pod_ip or "",
-            "StartTime": pod.status.start_time.strftime("%Y-%m-%dT%H:%M:%SZ") if pod.status.start_time else ""
-        }
-        deployment_status["PodStatuses"].append(pod_status)
-
-    return deployment_status
\ No newline at end of file
+    return kube_client.core_v1().list_namespaced_pod(namespace=namespace, label_selector=selector).items
+
+def fetch_deployment_status_and_pods(app_name, namespace='default', fields=ALL_FIELDS):
+    # Get the deployment
+    deployment = kube_client.apps_v1().read_namespaced_deployment(name=app_name, namespace=namespace)
+
+    pods = list_pods_for_deployment(deployment, namespace) if wants_pods(fields) else []
+    return build_deployment_status(app_name, deployment, pods, fields)
@@ -0,0 +1,58 @@
+# Production server settings, used by: gunicorn -c gunicorn.conf.py app:app
+import math
+import os
+import shutil
+
+# Every worker writes its metrics here and /metrics aggregates them.
+# Must be set before prometheus_client is imported, here and by the workers.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def available_cpus():
+    """CPUs this container may use: the cgroup CPU limit if set, else the CPUs we can run on."""
+    try:
+        # cgroup v2, e.g. "50000 100000" or "max 100000"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '4040')}"
+# One worker per CPU we're allotted. Jobs are shared through JOB_DIR; each worker runs its own
+# watch caches (WATCH_CACHE_NAMESPACES), and KUBE_API_QPS/BURST are split between the workers.
+workers = int(os.environ.get("GUNICORN_WORKERS", available_cpus()))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
+accesslog = "-"
+
+# Inherited by the workers, see kube_client
+os.environ["GUNICORN_WORKERS"] = str(workers)
+
+
+def on_starting(server):
+    # Metrics files left over from a previous run would be counted again
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,202 @@
+from kubernetes.client.rest import ApiException
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE_SECONDS = float(os.environ.get("JOB_BACKOFF_BASE_SECONDS", "1"))
+JOB_BACKOFF_MAX_SECONDS = float(os.environ.get("JOB_BACKOFF_MAX_SECONDS", "30"))
+# Finished jobs beyond this many are forgotten, oldest first
+JOB_HISTORY_SIZE = int(os.environ.get("JOB_HISTORY_SIZE", "1000"))
+# Every job's state is mirrored here, shared by all gunicorn workers, so /jobs/<id> works on any of them
+JOB_DIR = os.environ.get("JOB_DIR", "/tmp/jobs")
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    if isinstance(error, ApiException):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, urllib3.exceptions.HTTPError)
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given (1-based) failed attempt."""
+    return random.uniform(0, min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+def utc_timestamp():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Job:
+    def __init__(self, name, steps):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"
+        self.error = None
+        self.created_at = utc_timestamp()
+        self.started_at = None
+        self.finished_at = None
+        self.functions = [function for _, function in steps]
+        self.steps = [
+            {"Name": step_name, "Status": "pending", "Attempts": 0, "DurationSeconds": None, "Error": None}
+            for step_name, _ in steps
+        ]
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "JobId": self.id,
+                "Name": self.name,
+                "Status": self.status,
+                "Error": self.error,
+                "CreatedAt": self.created_at,
+                "StartedAt": self.started_at,
+                "FinishedAt": self.finished_at,
+                "Steps": [dict(step) for step in self.steps],
+            }
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+
+class JobQueue:
+    """Runs multi-step jobs on a small worker pool.
+
+    Each step is retried with exponential backoff and jitter while it fails
+    with a retryable error; the waiting happens on the worker thread, never
+    on the request thread that submitted the job.  A job runs in the
+    process that accepted it; its state is written to JOB_DIR on every
+    change, so any process can report it.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, name, steps):
+        """Queue a job made of ``(step_name, function)`` steps run in order."""
+        job = Job(name, steps)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._evict()
+        self._save(job)
+        self.pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """The job's state as a dict, wherever it runs; None if unknown."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+        try:
+            with open(os.path.join(JOB_DIR, f"{job_id}.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - JOB_HISTORY_SIZE, 0)]:
+            del self.jobs[job_id]
+
+    def _save(self, job):
+        # Written whole and renamed into place, so readers never see a partial file
+        os.makedirs(JOB_DIR, exist_ok=True)
+        path = os.path.join(JOB_DIR, f"{job.id}.json")
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(job.to_dict(), f)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"Couldn't write the state of job {job.id} to {JOB_DIR}: {e}")
+        if job.finished:
+            self._prune()
+
+    def _prune(self):
+        """Keep only the JOB_HISTORY_SIZE most recently updated job files of all processes."""
+        try:
+            paths = [entry.path for entry in os.scandir(JOB_DIR) if entry.name.endswith(".json")]
+            paths.sort(key=os.path.getmtime)
+        except OSError:
+            return
+        for path in paths[:max(len(paths) - JOB_HISTORY_SIZE, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _run(self, job):
+        with job.lock:
+            job.status = "running"
+            job.started_at = utc_timestamp()
+        self._save(job)
+
+        for step, function in zip(job.steps, job.functions):
+            if not self._run_step(job, step, function):
+                with job.lock:
+                    job.status = "failed"
+                    job.error = f"Step '{step['Name']}' failed: {step['Error']}"
+                    job.finished_at = utc_timestamp()
+                self._save(job)
+                logger.error(f"Job {job.id} ({job.name}) failed: {job.error}")
+                return
+
+        with job.lock:
+            job.status = "succeeded"
+            job.finished_at = utc_timestamp()
+        self._save(job)
+        logger.info(f"Job {job.id} ({job.name}) succeeded")
+
+    def _run_step(self, job, step, function):
+        start = time.perf_counter()
+        with job.lock:
+            step["Status"] = "running"
+        try:
+            for attempt in range(1, JOB_MAX_ATTEMPTS + 1):
+                with job.lock:
+                    step["Attempts"] = attempt
+                self._save(job)
+                try:
+                    function()
+                    with job.lock:
+                        step["Status"] = "succeeded"
+                        step["Error"] = None
+                    return True
+                except Exception as e:
+                    with job.lock:
+                        step["Error"] = str(e)
+                    if not is_retryable(e) or attempt == JOB_MAX_ATTEMPTS:
+                        with job.lock:
+                            step["Status"] = "failed"
+                        return False
+                    delay = backoff_delay(attempt)
+                    logger.warning(f"Job {job.id} step '{step['Name']}' failed (attempt {attempt}/{JOB_MAX_ATTEMPTS}), retrying in {delay:.1f}s: {e}")
+                    time.sleep(delay)
+        finally:
+            with job.lock:
+                step["DurationSeconds"] = round(time.perf_counter() - start, 3)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,178 @@
+from kubernetes import client, config
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter, Gauge, Histogram
+from urllib.parse import urlparse, parse_qs
+import contextvars
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Size of the urllib3 connection pool shared by every API call of the process.
+# Each watch stream holds one connection for as long as it runs.
+KUBE_POOL_MAXSIZE = int(os.environ.get("KUBE_POOL_MAXSIZE", "32"))
+# Client-side limit on API calls (like client-go's QPS/Burst), 0 disables it.
+# Calls that would have to wait longer than KUBE_API_MAX_WAIT_SECONDS fail with a 429 instead.
+KUBE_API_QPS = float(os.environ.get("KUBE_API_QPS", "50"))
+KUBE_API_BURST = int(os.environ.get("KUBE_API_BURST", "100"))
+# The limit is for the whole server, each gunicorn worker (see gunicorn.conf.py) gets its share
+SERVER_WORKERS = max(int(os.environ.get("GUNICORN_WORKERS", "1")), 1)
+KUBE_API_MAX_WAIT_SECONDS = float(os.environ.get("KUBE_API_MAX_WAIT_SECONDS", "5"))
+
+CLIENT_INIT_SECONDS = Gauge('kube_client_init_seconds', 'Time spent loading the Kubernetes config and building the API client',
+                            multiprocess_mode='max')
+API_CALL_LATENCY = Histogram('kube_api_call_latency_seconds', 'Kubernetes API call latency (until response headers)',
+                             ['verb', 'resource', 'status'])
+RATE_LIMIT_WAIT = Histogram('kube_api_rate_limit_wait_seconds', 'Time API calls waited for the client-side rate limit',
+                            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+RATE_LIMITED = Counter('kube_api_rate_limited_total', 'API calls refused by the client-side rate limit')
+
+# Per-request tally of API calls, see track_api_calls()
+_api_calls = contextvars.ContextVar('kube_api_calls', default=None)
+
+_api_client = None
+_apis = {}
+_lock = threading.Lock()
+
+
+def api_client():
+    """Return the process-wide ApiClient, loading the Kubernetes config on first use."""
+    global _api_client
+    if _api_client is None:
+        with _lock:
+            if _api_client is None:
+                start = time.perf_counter()
+                configuration = client.Configuration()
+                try:
+                    config.load_incluster_config(client_configuration=configuration)  # If running within a Kubernetes cluster
+                except config.config_exception.ConfigException:
+                    config.load_kube_config(client_configuration=configuration)  # Load default kubeconfig if outside cluster
+                configuration.connection_pool_maxsize = KUBE_POOL_MAXSIZE
+                _api_client = client.ApiClient(configuration)
+                _instrument(_api_client)
+                elapsed = time.perf_counter() - start
+                CLIENT_INIT_SECONDS.set(elapsed)
+                logger.info(f"Kubernetes client initialized in {elapsed * 1000:.1f}ms (pool size {KUBE_POOL_MAXSIZE})")
+    return _api_client
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average and bursts of up to ``burst``.
+
+    ``acquire`` reserves a token and sleeps until it is due, so waiting
+    callers are served in arrival order without spinning on the lock.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Take a token, waiting for it if needed; False if that would take longer than ``max_wait``."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            if wait > max_wait:
+                return False
+            self.tokens -= 1
+        if wait > 0:
+            RATE_LIMIT_WAIT.observe(wait)
+            time.sleep(wait)
+        return True
+
+
+_rate_limit = TokenBucket(KUBE_API_QPS / SERVER_WORKERS, KUBE_API_BURST // SERVER_WORKERS) if KUBE_API_QPS > 0 else None
+
+
+def _instrument(api_client):
+    # Every generated API method ends up in rest_client.request, wrap it once here
+    request = api_client.rest_client.request
+
+    def instrumented_request(method, url, *args, **kwargs):
+        verb, resource = describe_call(method, url)
+        if _rate_limit is not None and not _rate_limit.acquire(KUBE_API_MAX_WAIT_SECONDS):
+            # Same status the API server's priority and fairness would answer with, so callers retry alike
+            RATE_LIMITED.inc()
+            raise ApiException(status=429, reason=f"Too Many Requests: client-side limit of {_rate_limit.rate:g} calls/s")
+        status = "error"
+        start = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+            status = str(response.status)
+            return response
+        except ApiException as e:
+            status = str(e.status)
+            raise
+        finally:
+            API_CALL_LATENCY.labels(verb, resource, status).observe(time.perf_counter() - start)
+            calls = _api_calls.get()
+            if calls is not None:
+                calls[0] += 1
+
+    api_client.rest_client.request = instrumented_request
+
+
+def describe_call(method, url):
+    """Map an API request to a (verb, resource) pair, e.g. ("list", "pods")."""
+    parsed = urlparse(url)
+    segments = [s for s in parsed.path.split('/') if s]
+    # Drop the /api/v1 or /apis/<group>/<version> prefix
+    if segments[:1] == ['api']:
+        segments = segments[2:]
+    elif segments[:1] == ['apis']:
+        segments = segments[3:]
+    if len(segments) >= 3 and segments[0] == 'namespaces':
+        segments = segments[2:]
+    resource = segments[0] if segments else 'unknown'
+    named = len(segments) > 1
+    if len(segments) > 2:
+        resource = f"{resource}/{segments[2]}"
+
+    method = method.upper()
+    if method == 'GET':
+        if parse_qs(parsed.query).get('watch', [''])[0].lower() in ('true', '1'):
+            verb = 'watch'
+        else:
+            verb = 'get' if named else 'list'
+    else:
+        verb = {'POST': 'create', 'PUT': 'update', 'PATCH': 'patch',
+                'DELETE': 'delete' if named else 'deletecollection'}.get(method, method.lower())
+    return verb, resource
+
+
+def track_api_calls():
+    """Start counting API calls made in the current context; returns the counter.
+
+    The counter is a one-element list so code that copies the context (e.g.
+    work handed to a thread pool with contextvars.copy_context) adds to the
+    same tally.
+    """
+    calls = [0]
+    _api_calls.set(calls)
+    return calls
+
+
+def _api(api_class):
+    api = _apis.get(api_class)
+    if api is None:
+        api = _apis.setdefault(api_class, api_class(api_client()))
+    return api
+
+
+def apps_v1():
+    return _api(client.AppsV1Api)
+
+
+def core_v1():
+    return _api(client.CoreV1Api)
+
+
+def networking_v1():
+    return _api(client.NetworkingV1Api)
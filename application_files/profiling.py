@@ -0,0 +1,223 @@
+from collections import Counter
+from flask import Response, abort, g, jsonify, request, send_from_directory
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Off unless PROFILING_ENABLED=true: no hooks and no routes are installed at all
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+# Required with PROFILING_ENABLED: every profiling request must send it in the X-Profile-Token header
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+# Shared by all processes of a server (e.g. gunicorn workers), so any of them can serve a profile another one wrote
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+PROFILE_HISTORY = int(os.environ.get("PROFILE_HISTORY", "50"))
+SAMPLER_INTERVAL_SECONDS = float(os.environ.get("SAMPLER_INTERVAL_SECONDS", "0.005"))
+SAMPLER_MAX_SECONDS = float(os.environ.get("SAMPLER_MAX_SECONDS", "300"))
+PROFILE_TOP_FUNCTIONS = 40
+
+
+def authorized():
+    return hmac.compare_digest(request.headers.get("X-Profile-Token", ""), PROFILING_TOKEN)
+
+
+def new_profile_id(kind):
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{kind}-{uuid.uuid4().hex[:8]}"
+
+
+def prune_profiles():
+    """Keep only the newest PROFILE_HISTORY files."""
+    try:
+        names = sorted(os.listdir(PROFILE_DIR))
+    except OSError:
+        return
+    for name in names[:max(len(names) - PROFILE_HISTORY, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Statistical profiler: samples the stack of every thread at a fixed interval.
+
+    The result is written as collapsed stacks (``thread;outer;...;inner
+    count`` per line), the input format of flamegraph.pl and speedscope.
+    It samples only the process it runs in, under gunicorn that's one worker.
+    """
+
+    def __init__(self, seconds, interval=SAMPLER_INTERVAL_SECONDS):
+        self.profile_id = new_profile_id("sampled")
+        self.seconds = seconds
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        own_thread = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + self.seconds
+        while not self.stopped.wait(self.interval) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.write()
+
+    def write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{self.profile_id}.folded"), "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        prune_profiles()
+        logger.info(f"Sampling profile {self.profile_id} written: {self.samples} samples")
+
+
+class Profiling:
+    """Per-request profiles and an on-demand sampler for a Flask app.
+
+    A request with ``X-Profile: true`` (or ``?profile=true``) runs under
+    cProfile; the stats are stored in PROFILE_DIR and the response names
+    them in its X-Profile-Id header.  Only one request per process is
+    profiled at a time, others asking meanwhile are served unprofiled.
+    """
+
+    def __init__(self):
+        self.request_lock = threading.Lock()
+        self.sampler = None
+        self.sampler_lock = threading.Lock()
+
+    def install(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule('/debug/profiles', 'list_profiles', self.list_profiles, methods=['GET'])
+        app.add_url_rule('/debug/profiles/<string:profile_id>', 'get_profile', self.get_profile, methods=['GET'])
+        app.add_url_rule('/debug/profiler/start', 'start_profiler', self.start_profiler, methods=['POST'])
+        app.add_url_rule('/debug/profiler/stop', 'stop_profiler', self.stop_profiler, methods=['POST'])
+        logger.info(f"Profiling enabled, profiles are stored in {PROFILE_DIR}")
+
+    # ---- per-request profiles ----
+
+    def before_request(self):
+        if request.path.startswith('/debug/'):
+            if not authorized():
+                abort(403)
+            return
+        wanted = request.headers.get("X-Profile", request.args.get("profile", "")).lower() == "true"
+        if not wanted or not authorized() or not self.request_lock.acquire(blocking=False):
+            return
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def after_request(self, response):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+        # A streamed body is produced after this point and isn't part of the profile
+        profiler.disable()
+        self.request_lock.release()
+        profile_id = new_profile_id("request")
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+        prune_profiles()
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    def teardown_request(self, exc):
+        # after_request doesn't run when the view raised
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self.request_lock.release()
+
+    def list_profiles(self):
+        try:
+            names = sorted(os.listdir(PROFILE_DIR), reverse=True)
+        except OSError:
+            names = []
+        return jsonify({"profiles": [os.path.splitext(name)[0] for name in names]}), 200
+
+    def get_profile(self, profile_id):
+        """A request profile as a pstats summary (``?format=pstats`` for the raw file), or a sampled one as collapsed stacks."""
+        for name in (f"{profile_id}.prof", f"{profile_id}.folded"):
+            path = os.path.join(PROFILE_DIR, name)
+            if not os.path.isfile(path):
+                continue
+            if name.endswith(".folded") or request.args.get("format") == "pstats":
+                mimetype = "text/plain" if name.endswith(".folded") else "application/octet-stream"
+                return send_from_directory(PROFILE_DIR, name, mimetype=mimetype)
+            text = io.StringIO()
+            sort = request.args.get("sort", "cumulative")
+            try:
+                pstats.Stats(path, stream=text).sort_stats(sort).print_stats(PROFILE_TOP_FUNCTIONS)
+            except KeyError:
+                return jsonify({"error": f"Unknown sort key '{sort}'"}), 400
+            return Response(text.getvalue(), mimetype="text/plain")
+        return jsonify({"error": f"Profile '{profile_id}' not found"}), 404
+
+    # ---- sampling profiler ----
+
+    def start_profiler(self):
+        try:
+            seconds = float(request.args.get("seconds", "30"))
+        except ValueError:
+            return jsonify({"error": "'seconds' must be a number"}), 400
+        if not 0 < seconds <= SAMPLER_MAX_SECONDS:
+            return jsonify({"error": f"'seconds' must be between 0 and {SAMPLER_MAX_SECONDS:g}"}), 400
+        with self.sampler_lock:
+            if self.sampler is not None and self.sampler.thread.is_alive():
+                return jsonify({"error": "The profiler is already running in this process",
+                                "id": self.sampler.profile_id, "pid": os.getpid()}), 409
+            self.sampler = Sampler(seconds).start()
+        return jsonify({"id": self.sampler.profile_id, "pid": os.getpid(), "seconds": seconds}), 202
+
+    def stop_profiler(self):
+        with self.sampler_lock:
+            sampler = self.sampler
+            if sampler is None or not sampler.thread.is_alive():
+                return jsonify({"error": "The profiler isn't running in this process", "pid": os.getpid()}), 404
+            sampler.stop()
+        return jsonify({"id": sampler.profile_id, "pid": os.getpid(), "samples": sampler.samples}), 200
+
+
+def install(app):
+    """Add the profiling hooks and /debug routes to ``app`` if PROFILING_ENABLED, else do nothing."""
+    if not PROFILING_ENABLED:
+        return
+    if not PROFILING_TOKEN:
+        # Profiles expose code paths and arguments, never serve them unauthenticated
+        logger.error("PROFILING_ENABLED is set but PROFILING_TOKEN is empty, profiling stays off")
+        return
+    Profiling().install(app)
@@ -0,0 +1,100 @@
+"""Pick parts of a kubernetes client model for a response (the ``fields=`` query parameter).
+
+``to_dict()`` walks and copies the whole object tree, which for a Deployment
+is hundreds of nested models.  ``project_model`` only follows the requested
+dotted paths and serializes what it finds at their ends.
+"""
+from kubernetes.client import models
+import re
+
+
+def parse_fields(value):
+    """Split a ``fields=`` value such as ``metadata.name,spec.replicas`` into paths.
+
+    Returns None when the parameter is missing or empty.
+    """
+    if not value:
+        return None
+    return [field.strip() for field in value.split(",") if field.strip()]
+
+
+def attribute_name(model, name):
+    """Resolve ``name`` (python or JSON spelling, e.g. ``resourceVersion``) to the model attribute."""
+    if name in model.openapi_types:
+        return name
+    for attribute, json_name in model.attribute_map.items():
+        if json_name == name:
+            return attribute
+    model_name = model.__name__ if isinstance(model, type) else type(model).__name__
+    raise ValueError(f"Unknown field '{name}' on {model_name}")
+
+
+def model_class(type_name):
+    """``'V1ObjectMeta'`` or ``'List[V1Container]'`` -> the model class, None for plain types."""
+    match = re.fullmatch(r"[Ll]ist\[(.+)\]", type_name)
+    return getattr(models, match.group(1) if match else type_name, None)
+
+
+def check_fields(model, fields):
+    """Raise ValueError if any dotted field doesn't exist on the ``model`` class.
+
+    Lets a request be rejected before any work is done.  Keys below a plain
+    dict (labels, annotations, ...) can't be checked and are accepted.
+    """
+    for field in fields:
+        node = model
+        for name in field.split("."):
+            if node is None:
+                raise ValueError(f"Unknown field '{field}'")
+            type_name = node.openapi_types[attribute_name(node, name)]
+            if type_name.lower().startswith("dict"):
+                break
+            node = model_class(type_name)
+
+
+def to_plain(value):
+    """Serialize a value the same way ``to_dict()`` does, but only this subtree."""
+    if isinstance(value, list):
+        return [to_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return value
+
+
+def project(value, path, existing=None):
+    """Follow ``path`` (a list of names) into ``value`` and return what it selects, nested like ``to_dict()``.
+
+    Lists are mapped over on the way.  ``existing`` is an earlier projection
+    of the same value; the selection is merged into it, so paths sharing a
+    prefix (``metadata.labels.a`` and ``metadata.labels.b``) end up side by side.
+    """
+    if not path or value is None:
+        return to_plain(value)
+    if isinstance(value, list):
+        if not isinstance(existing, list) or len(existing) != len(value):
+            existing = [None] * len(value)
+        return [project(item, path, before) for item, before in zip(value, existing)]
+    if isinstance(value, dict):
+        key, child = path[0], value.get(path[0])
+    elif hasattr(value, "openapi_types"):
+        key = attribute_name(value, path[0])
+        child = getattr(value, key)
+    else:
+        raise ValueError(f"Cannot select '{path[0]}' from a {type(value).__name__}")
+    result = existing if isinstance(existing, dict) else {}
+    result[key] = project(child, path[1:], result.get(key))
+    return result
+
+
+def project_model(model, fields):
+    """Return a dict with only the given dotted ``fields`` of ``model``.
+
+    Keys use the same python names as ``to_dict()`` so a projected response
+    is a subset of the full one.  Raises ValueError for unknown fields.
+    """
+    result = {}
+    for field in fields:
+        result = project(model, field.split("."), result)
+    return result
@@ -0,0 +1,59 @@
+from kubernetes.client.rest import ApiException
+import hashlib
+import json
+import logging
+import kube_client
+
+logger = logging.getLogger(__name__)
+
+SPEC_HASH_ANNOTATION = "kaas/spec-hash"
+FIELD_MANAGER = "simple-kaas"
+
+
+def spec_hash(body):
+    """Stable hash of an object's desired state, ignoring the hash annotation itself."""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def apply_resource(body, read, patch, namespace='default'):
+    """Reconcile one object with server-side apply, skipping unchanged objects.
+
+    ``read`` and ``patch`` are the ``read_namespaced_*`` / ``patch_namespaced_*``
+    methods for the object's kind.  The desired spec is hashed and stored in
+    the ``kaas/spec-hash`` annotation; if the live object already carries the
+    same hash nothing is written, so an unchanged object costs one GET.
+    Otherwise a single server-side apply creates or updates it.
+    Returns True if the object was written.
+    """
+    desired = kube_client.api_client().sanitize_for_serialization(body)
+    name = desired["metadata"]["name"]
+    desired_hash = spec_hash(desired)
+    desired["metadata"].setdefault("annotations", {})[SPEC_HASH_ANNOTATION] = desired_hash
+
+    try:
+        # Skip model deserialization, only the annotations are needed
+        response = read(name=name, namespace=namespace, _preload_content=False)
+        live = json.loads(response.data)
+        annotations = live.get("metadata", {}).get("annotations") or {}
+        if annotations.get(SPEC_HASH_ANNOTATION) == desired_hash:
+            logger.info(f"{desired['kind']} {name} is up to date, skipping.")
+            return False
+    except ApiException as e:
+        if e.status != 404:
+            raise
+
+    server_side_apply(desired, patch, namespace)
+    return True
+
+
+def server_side_apply(body, patch, namespace='default'):
+    """Create or update an object in a single server-side apply call.
+
+    Fields this manager applied before but that are missing from ``body``
+    are removed by the API server.
+    """
+    desired = kube_client.api_client().sanitize_for_serialization(body)
+    logger.info(f"Applying {desired['kind']} {desired['metadata']['name']}.")
+    return patch(name=desired["metadata"]["name"], namespace=namespace, body=desired,
+                 field_manager=FIELD_MANAGER, force=True, _content_type="application/apply-patch+yaml")
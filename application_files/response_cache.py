@@ -0,0 +1,45 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+# Serialized status responses kept per process, least recently used evicted first
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+
+
+def make_etag(key, versions):
+    """Hash a response key (route, query) and the resourceVersions it was built from."""
+    digest = hashlib.sha1(repr(key).encode())
+    for version in versions:
+        digest.update(b"\0" + version.encode())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Response bodies keyed by ETag.
+
+    Since the ETag already changes with every resourceVersion behind a
+    response, entries never go stale and need no TTL, only a size bound.
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, etag):
+        with self.lock:
+            body = self.entries.get(etag)
+            if body is not None:
+                self.entries.move_to_end(etag)
+            return body
+
+    def put(self, etag, body):
+        with self.lock:
+            self.entries[etag] = body
+            self.entries.move_to_end(etag)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,376 @@
+from collections import OrderedDict
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter, Histogram
+import datetime
+import logging
+import os
+import threading
+
+import kube_client
+import watch_cache
+
+logger = logging.getLogger(__name__)
+
+# A rollout that isn't available or failed after this long is reported as timed out
+ROLLOUT_TIMEOUT_SECONDS = float(os.environ.get("ROLLOUT_TIMEOUT_SECONDS", "600"))
+# Longest a single request may block with wait=true. Every waiting request holds one of the
+# worker's threads (GUNICORN_THREADS, 4 by default), so at most ROLLOUT_MAX_WAITERS requests per
+# process wait at once; further wait=true requests are answered 503 with Retry-After right away.
+ROLLOUT_WAIT_MAX_SECONDS = float(os.environ.get("ROLLOUT_WAIT_MAX_SECONDS", "120"))
+ROLLOUT_MAX_WAITERS = int(os.environ.get("ROLLOUT_MAX_WAITERS", "2"))
+# Finished rollouts beyond this many are forgotten, oldest first
+ROLLOUT_HISTORY_SIZE = int(os.environ.get("ROLLOUT_HISTORY_SIZE", "1000"))
+# Rollouts followed at once per process in namespaces without a watch cache, each costs two watch streams
+ROLLOUT_MAX_WATCHED = int(os.environ.get("ROLLOUT_MAX_WATCHED", "20"))
+# Those streams are reopened this often, which is also how long they may outlive a finished rollout
+ROLLOUT_WATCH_TIMEOUT_SECONDS = int(os.environ.get("ROLLOUT_WATCH_TIMEOUT_SECONDS", "30"))
+
+# Container states that usually mean the rollout is stuck, reported as warnings
+STUCK_REASONS = {"ErrImagePull", "ImagePullBackOff", "InvalidImageName", "CrashLoopBackOff",
+                 "CreateContainerConfigError"}
+
+TIME_TO_READY = Histogram('kaas_rollout_time_to_ready_seconds', 'Time from Deployment creation until it is available',
+                          buckets=(1, 2, 5, 10, 15, 30, 45, 60, 90, 120, 180, 300, 600))
+ROLLOUTS = Counter('kaas_rollouts_total', 'Rollouts of created applications by outcome', ['outcome'])
+
+
+def utc_timestamp():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def condition_time(conditions, condition_type):
+    """lastTransitionTime of a condition that is True, else None."""
+    for condition in conditions or []:
+        if condition.type == condition_type and condition.status == "True":
+            return condition.last_transition_time
+    return None
+
+
+def images_pulled_time(pod):
+    """When every container of the pod had its image and started, else None."""
+    statuses = pod.status.container_statuses if pod.status else None
+    if not statuses:
+        return None
+    started = []
+    for status in statuses:
+        state = status.state
+        if state is not None and state.running is not None:
+            started.append(state.running.started_at)
+        elif state is not None and state.terminated is not None:
+            started.append(state.terminated.started_at)
+        else:
+            return None
+    return max(started) if None not in started else None
+
+
+def phase_seconds(created, replicas, times):
+    """Seconds from ``created`` until ``replicas`` pods had reached a phase, None if not yet."""
+    if replicas == 0:
+        return 0.0
+    times = sorted(t for t in times if t is not None)
+    if len(times) < replicas or created is None:
+        return None
+    return max((times[replicas - 1] - created).total_seconds(), 0.0)
+
+
+def owned_by(pod, deployment_name):
+    """Whether the pod belongs to one of this Deployment's ReplicaSets.
+
+    Every version of an app shares the ``app`` label, so the selector also
+    matches pods of the app's earlier Deployments.  A Deployment's
+    ReplicaSets are named ``<deployment>-<pod-template-hash>``, and their
+    pods carry that hash as a label.
+    """
+    template_hash = (pod.metadata.labels or {}).get("pod-template-hash")
+    if template_hash is None:
+        return False
+    return any(owner.kind == "ReplicaSet" and owner.name == f"{deployment_name}-{template_hash}"
+               for owner in pod.metadata.owner_references or [])
+
+
+def is_available(deployment, replicas):
+    status = deployment.status
+    if status is None or (status.observed_generation or 0) < (deployment.metadata.generation or 0):
+        return False
+    return (status.updated_replicas or 0) >= replicas and (status.available_replicas or 0) >= replicas
+
+
+class Rollout:
+    """Progress of one Deployment towards being available.
+
+    ``evaluate`` is called with the Deployment and its pods whenever the
+    namespace cache or the rollout's own watches see a change, and derives
+    everything from them.  Phase timings are seconds since
+    the Deployment's creationTimestamp, taken from the timestamps the API
+    server recorded (PodScheduled, container start, Available).  So every
+    process reports the same numbers, however late it started watching.
+    """
+
+    def __init__(self, name, namespace, observe):
+        self.name = name
+        self.namespace = namespace
+        self.observe = observe
+        self.status = "pending"
+        self.error = None
+        self.warnings = []
+        self.phases = {"Scheduled": None, "ImagePulled": None, "Ready": None}
+        self.started_at = utc_timestamp()
+        self.finished_at = None
+        self.seen = False
+        self.done = threading.Event()
+        self.on_finish = None
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "DeploymentName": self.name,
+                "Namespace": self.namespace,
+                "Status": self.status,
+                "Error": self.error,
+                "Warnings": list(self.warnings),
+                "PhaseSeconds": dict(self.phases),
+                "StartedAt": self.started_at,
+                "FinishedAt": self.finished_at,
+            }
+
+    def evaluate(self, deployment, pods):
+        with self.lock:
+            if self.done.is_set():
+                return
+            if deployment is None:
+                if self.seen:
+                    self._finish("failed", "Deployment was deleted")
+                return
+            self.seen = True
+            self.status = "progressing"
+
+            created = deployment.metadata.creation_timestamp
+            replicas = deployment.spec.replicas if deployment.spec.replicas is not None else 1
+            pods = [pod for pod in pods if owned_by(pod, self.name)]
+            self.phases["Scheduled"] = phase_seconds(
+                created, replicas, [condition_time(pod.status.conditions if pod.status else None, "PodScheduled")
+                                    for pod in pods])
+            self.phases["ImagePulled"] = phase_seconds(created, replicas, [images_pulled_time(pod) for pod in pods])
+            self.warnings = sorted({
+                f"{pod.metadata.name}: {status.state.waiting.reason}"
+                for pod in pods for status in (pod.status.container_statuses or [] if pod.status else [])
+                if status.state and status.state.waiting and status.state.waiting.reason in STUCK_REASONS
+            })
+
+            conditions = deployment.status.conditions if deployment.status else None
+            for condition in conditions or []:
+                if condition.type == "Progressing" and condition.reason == "ProgressDeadlineExceeded":
+                    self._finish("failed", condition.message or "Progress deadline exceeded")
+                    return
+
+            if is_available(deployment, replicas):
+                ready_at = condition_time(conditions, "Available") or datetime.datetime.now(datetime.timezone.utc)
+                self.phases["Ready"] = phase_seconds(created, 1, [ready_at])
+                self._finish("available")
+
+    def expire(self):
+        with self.lock:
+            if not self.done.is_set():
+                self._finish("timeout", f"Not available after {ROLLOUT_TIMEOUT_SECONDS:g}s")
+
+    def _finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished_at = utc_timestamp()
+        if self.observe:
+            ROLLOUTS.labels(status).inc()
+            if status == "available" and self.phases["Ready"] is not None:
+                TIME_TO_READY.observe(self.phases["Ready"])
+        logger.info(f"Rollout of {self.namespace}/{self.name} finished: {status} {self.phases}")
+        self.done.set()
+        if self.on_finish is not None:
+            self.on_finish()
+
+    def wait(self, timeout):
+        self.done.wait(min(timeout, ROLLOUT_WAIT_MAX_SECONDS))
+        return self
+
+
+class RolloutWatch:
+    """Watches one Deployment and its pods for a rollout outside the watch caches.
+
+    The Deployment is watched by name (``metadata.name`` field selector),
+    its pods by the Deployment's label selector, each on its own thread,
+    until the rollout is done.  ``release`` is called once both threads have
+    ended.
+    """
+
+    def __init__(self, rollout, release):
+        self.rollout = rollout
+        self.release = release
+        self.deployment = None
+        self.pods = {}
+        # The pods are watched once the Deployment, and so its label selector, is known
+        self.pod_selector = None
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        self._spawn("deployment", self._follow_deployment)
+
+    def _spawn(self, kind, target):
+        with self.lock:
+            self.running += 1
+        threading.Thread(target=self._run, args=(target,), daemon=True,
+                         name=f"rollout-{kind}-{self.rollout.namespace}-{self.rollout.name}").start()
+
+    def _run(self, target):
+        try:
+            target()
+        finally:
+            with self.lock:
+                self.running -= 1
+                last = self.running == 0
+            if last:
+                self.release()
+
+    def _follow_deployment(self):
+        field_selector = f"metadata.name={self.rollout.name}"
+
+        def relist():
+            response = kube_client.apps_v1().list_namespaced_deployment(self.rollout.namespace,
+                                                                        field_selector=field_selector)
+            with self.lock:
+                self.deployment = response.items[0] if response.items else None
+            return response.metadata.resource_version
+
+        def on_event(event_type, deployment):
+            with self.lock:
+                self.deployment = None if event_type == "DELETED" else deployment
+
+        self._follow(kube_client.apps_v1().list_namespaced_deployment, {"field_selector": field_selector},
+                     relist, on_event)
+
+    def _follow_pods(self, label_selector):
+        def relist():
+            response = kube_client.core_v1().list_namespaced_pod(self.rollout.namespace, label_selector=label_selector)
+            with self.lock:
+                self.pods = {pod.metadata.name: pod for pod in response.items}
+            return response.metadata.resource_version
+
+        def on_event(event_type, pod):
+            with self.lock:
+                if event_type == "DELETED":
+                    self.pods.pop(pod.metadata.name, None)
+                else:
+                    self.pods[pod.metadata.name] = pod
+
+        self._follow(kube_client.core_v1().list_namespaced_pod, {"label_selector": label_selector},
+                     relist, on_event)
+
+    def _changed(self):
+        with self.lock:
+            deployment, pods = self.deployment, list(self.pods.values())
+            start_pods = deployment is not None and self.pod_selector is None
+            if start_pods:
+                match_labels = deployment.spec.selector.match_labels or {}
+                self.pod_selector = ",".join(f"{key}={value}" for key, value in match_labels.items())
+        if start_pods:
+            self._spawn("pods", lambda: self._follow_pods(self.pod_selector))
+        self.rollout.evaluate(deployment, pods)
+
+    def _follow(self, list_func, selector, relist, on_event):
+        """List, then watch from there until the rollout is done, relisting after errors."""
+        rollout = self.rollout
+        resource_version = None
+        while not rollout.done.is_set():
+            try:
+                if resource_version is None:
+                    resource_version = relist()
+                    self._changed()
+                w = watch.Watch()
+                for event in w.stream(list_func, rollout.namespace, resource_version=resource_version,
+                                      timeout_seconds=ROLLOUT_WATCH_TIMEOUT_SECONDS, **selector):
+                    obj = event["object"]
+                    resource_version = obj.metadata.resource_version
+                    on_event(event["type"], obj)
+                    self._changed()
+                    if rollout.done.is_set():
+                        w.stop()
+            except ApiException as e:
+                if e.status != 410:
+                    logger.warning(f"Watching rollout of {rollout.namespace}/{rollout.name} failed: {e}")
+                    rollout.done.wait(watch_cache.WATCH_RETRY_SECONDS)
+                # Our resourceVersion is too old or the stream broke, start over from a fresh list
+                resource_version = None
+            except Exception as e:
+                logger.warning(f"Watching rollout of {rollout.namespace}/{rollout.name} failed: {e}")
+                rollout.done.wait(watch_cache.WATCH_RETRY_SECONDS)
+                resource_version = None
+
+
+class RolloutTracker:
+    """Follows rollouts through the shared namespace watch caches.
+
+    Tracking costs no API calls of its own: every rollout in a namespace
+    listens to the same Deployment and Pod watches.  In namespaces the watch
+    cache doesn't cover (or with it disabled) each rollout gets its own
+    narrow watches instead (``RolloutWatch``), at most
+    ``ROLLOUT_MAX_WATCHED`` at a time.  Rollouts are kept in memory, per
+    process; any process can start tracking a Deployment on request.
+    """
+
+    def __init__(self):
+        self.rollouts = OrderedDict()
+        self.watched = threading.BoundedSemaphore(ROLLOUT_MAX_WATCHED) if ROLLOUT_MAX_WATCHED > 0 else None
+        self.lock = threading.Lock()
+
+    def track(self, name, namespace='default', observe=False):
+        """Start (or return the existing) tracking of a Deployment's rollout.
+
+        Only the process that created the Deployment passes ``observe`` so
+        the metrics count every rollout once.  Returns None when the rollout
+        would need its own watches and ``ROLLOUT_MAX_WATCHED`` are running.
+        """
+        key = (namespace, name)
+        cached = watch_cache.enabled_for(namespace)
+        with self.lock:
+            rollout = self.rollouts.get(key)
+            if rollout is not None:
+                return rollout
+            if not cached and (self.watched is None or not self.watched.acquire(blocking=False)):
+                return None
+            rollout = Rollout(name, namespace, observe)
+            self.rollouts[key] = rollout
+            self._evict()
+
+        timer = threading.Timer(ROLLOUT_TIMEOUT_SECONDS, rollout.expire)
+        timer.daemon = True
+        if cached:
+            cache = watch_cache.get_cache(namespace)
+            listener = lambda: rollout.evaluate(cache.get_deployment(name), cache.get_pods_for_deployment(name))
+
+            def finished():
+                cache.remove_listener(listener)
+                timer.cancel()
+
+            rollout.on_finish = finished
+            cache.add_listener(listener)
+            timer.start()
+            listener()
+        else:
+            rollout.on_finish = timer.cancel
+            timer.start()
+            RolloutWatch(rollout, self.watched.release).start()
+        return rollout
+
+    def get(self, name, namespace='default'):
+        with self.lock:
+            return self.rollouts.get((namespace, name))
+
+    def _evict(self):
+        finished = [key for key, rollout in self.rollouts.items() if rollout.done.is_set()]
+        for key in finished[:max(len(finished) - ROLLOUT_HISTORY_SIZE, 0)]:
+            del self.rollouts[key]
+
+
+rollout_tracker = RolloutTracker()
+# Taken (without blocking) by every request that waits for a rollout, see ROLLOUT_MAX_WAITERS
+rollout_waiters = threading.BoundedSemaphore(ROLLOUT_MAX_WAITERS)
@@ -0,0 +1,52 @@
+from prometheus_client import Counter
+import threading
+
+SHARED_CALLS = Counter('kaas_singleflight_shared_total', 'Calls answered by an identical call already in flight', ['group'])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses identical concurrent calls into one.
+
+    The first caller for a key runs the function; callers arriving with the
+    same key while it runs wait and get its result (or its exception).
+    Nothing is kept once the call returns, so this never serves anything
+    older than a call that was already running when the request came in.
+    Results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            SHARED_CALLS.labels(self.group).inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
@@ -0,0 +1,66 @@
+from kubernetes import client
+import pytest
+
+import projection
+
+
+def deployment():
+    return client.V1Deployment(
+        metadata=client.V1ObjectMeta(name="web", namespace="default",
+                                     labels={"app": "web", "tier": "frontend"}),
+        spec=client.V1DeploymentSpec(
+            replicas=2,
+            selector=client.V1LabelSelector(match_labels={"app": "web"}),
+            template=client.V1PodTemplateSpec(spec=client.V1PodSpec(containers=[
+                client.V1Container(name="app", image="web:1"),
+                client.V1Container(name="sidecar", image="proxy:2"),
+            ])),
+        ),
+    )
+
+
+def test_label_path_keeps_the_label_key():
+    assert projection.project_model(deployment(), ["metadata.labels.app"]) == {
+        "metadata": {"labels": {"app": "web"}},
+    }
+
+
+def test_label_paths_merge():
+    fields = ["metadata.labels.app", "metadata.labels.tier", "metadata.name"]
+    assert projection.project_model(deployment(), fields) == {
+        "metadata": {"labels": {"app": "web", "tier": "frontend"}, "name": "web"},
+    }
+
+
+def test_missing_label_is_none():
+    assert projection.project_model(deployment(), ["metadata.labels.missing"]) == {
+        "metadata": {"labels": {"missing": None}},
+    }
+
+
+def test_list_items_merge():
+    fields = ["spec.template.spec.containers.name", "spec.template.spec.containers.image"]
+    containers = projection.project_model(deployment(), fields)["spec"]["template"]["spec"]["containers"]
+    assert containers == [{"name": "app", "image": "web:1"}, {"name": "sidecar", "image": "proxy:2"}]
+
+
+def test_projection_is_a_subset_of_to_dict():
+    model = deployment()
+    fields = ["metadata", "metadata.labels.app", "spec.replicas", "spec.selector.match_labels.app"]
+    full = model.to_dict()
+    projected = projection.project_model(model, fields)
+    assert projected["metadata"] == full["metadata"]
+    assert projected["spec"] == {"replicas": 2, "selector": {"match_labels": {"app": "web"}}}
+
+
+def test_json_field_names_are_accepted():
+    assert projection.project_model(deployment(), ["spec.selector.matchLabels"]) == {
+        "spec": {"selector": {"match_labels": {"app": "web"}}},
+    }
+
+
+def test_unknown_field():
+    with pytest.raises(ValueError):
+        projection.project_model(deployment(), ["metadata.nope"])
+    with pytest.raises(ValueError):
+        projection.check_fields(client.V1Deployment, ["spec.nope"])
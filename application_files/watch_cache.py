@@ -0,0 +1,256 @@
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+import logging
+import os
+import threading
+import time
+import kube_client
+
+logger = logging.getLogger(__name__)
+
+# Set WATCH_CACHE_ENABLED=false to always read straight from the API server
+WATCH_CACHE_ENABLED = os.environ.get("WATCH_CACHE_ENABLED", "true").lower() == "true"
+# Only these namespaces (comma separated) are cached, each costs two watch streams for the life of the process.
+# Requests for any other namespace read straight from the API server.
+WATCH_CACHE_NAMESPACES = {namespace.strip() for namespace in
+                          os.environ.get("WATCH_CACHE_NAMESPACES", "default").split(",") if namespace.strip()}
+WATCH_TIMEOUT_SECONDS = int(os.environ.get("WATCH_TIMEOUT_SECONDS", "300"))
+WATCH_RETRY_SECONDS = 5
+
+
+def selector_matches(selector, labels):
+    """Return True if a V1LabelSelector selects an object with the given labels."""
+    if selector is None:
+        return False
+    labels = labels or {}
+    match_labels = selector.match_labels or {}
+    match_expressions = selector.match_expressions or []
+    if not match_labels and not match_expressions:
+        # An empty selector matches nothing for a Deployment
+        return False
+
+    for key, value in match_labels.items():
+        if labels.get(key) != value:
+            return False
+
+    for expression in match_expressions:
+        values = expression.values or []
+        if expression.operator == "In" and labels.get(expression.key) not in values:
+            return False
+        if expression.operator == "NotIn" and labels.get(expression.key) in values:
+            return False
+        if expression.operator == "Exists" and expression.key not in labels:
+            return False
+        if expression.operator == "DoesNotExist" and expression.key in labels:
+            return False
+    return True
+
+
+class NamespaceCache:
+    """In-memory copy of the Deployments and Pods of one namespace.
+
+    The cache lists both resources once, then follows watch events to keep
+    itself up to date.  ``pods_by_deployment`` is an index from a deployment
+    name to the names of the pods its label selector matches, so a status
+    lookup never has to scan every pod.  Listeners are called after every
+    change, on the watch threads.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.deployments = {}
+        self.pods = {}
+        self.pods_by_deployment = {}
+        self.listeners = set()
+        self.lock = threading.RLock()
+        self.synced = threading.Event()
+        self.start_lock = threading.Lock()
+
+    # ---- public read API ----
+
+    def get_deployment(self, name):
+        with self.lock:
+            return self.deployments.get(name)
+
+    def get_pods_for_deployment(self, name):
+        with self.lock:
+            pod_names = sorted(self.pods_by_deployment.get(name, ()))
+            return [self.pods[pod_name] for pod_name in pod_names]
+
+    def list_deployments(self):
+        with self.lock:
+            return [self.deployments[name] for name in sorted(self.deployments)]
+
+    def versions(self, names=None):
+        """``name@resourceVersion`` of the given deployments (all by default) and their pods.
+
+        Any change to a deployment or one of its pods changes this list, so it
+        can key a response without building it.
+        """
+        with self.lock:
+            names = sorted(self.deployments) if names is None else names
+            versions = []
+            for name in names:
+                deployment = self.deployments.get(name)
+                if deployment is None:
+                    continue
+                versions.append(f"{name}@{deployment.metadata.resource_version}")
+                versions.extend(f"{pod_name}@{self.pods[pod_name].metadata.resource_version}"
+                                for pod_name in sorted(self.pods_by_deployment.get(name, ())))
+            return versions
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.add(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            self.listeners.discard(listener)
+
+    def _notify(self):
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.warning(f"Cache listener failed in namespace {self.namespace}: {e}")
+
+    # ---- startup ----
+
+    def start(self):
+        deployments_rv = self._list_deployments()
+        pods_rv = self._list_pods()
+        self.synced.set()
+
+        threading.Thread(
+            target=self._watch_loop,
+            args=(self._list_deployments, kube_client.apps_v1().list_namespaced_deployment,
+                  self._on_deployment_event, deployments_rv),
+            name=f"watch-deployments-{self.namespace}",
+            daemon=True,
+        ).start()
+        threading.Thread(
+            target=self._watch_loop,
+            args=(self._list_pods, kube_client.core_v1().list_namespaced_pod,
+                  self._on_pod_event, pods_rv),
+            name=f"watch-pods-{self.namespace}",
+            daemon=True,
+        ).start()
+
+    # ---- list ----
+
+    def _list_deployments(self):
+        response = kube_client.apps_v1().list_namespaced_deployment(namespace=self.namespace)
+        with self.lock:
+            self.deployments = {d.metadata.name: d for d in response.items}
+            self._rebuild_index()
+        self._notify()
+        return response.metadata.resource_version
+
+    def _list_pods(self):
+        response = kube_client.core_v1().list_namespaced_pod(namespace=self.namespace)
+        with self.lock:
+            self.pods = {p.metadata.name: p for p in response.items}
+            self._rebuild_index()
+        self._notify()
+        return response.metadata.resource_version
+
+    # ---- watch ----
+
+    def _watch_loop(self, relist, list_func, on_event, resource_version):
+        while True:
+            try:
+                w = watch.Watch()
+                for event in w.stream(list_func, namespace=self.namespace,
+                                      resource_version=resource_version,
+                                      timeout_seconds=WATCH_TIMEOUT_SECONDS):
+                    obj = event["object"]
+                    resource_version = obj.metadata.resource_version
+                    on_event(event["type"], obj)
+                    self._notify()
+            except ApiException as e:
+                if e.status == 410:
+                    # Our resourceVersion is too old, start over from a fresh list
+                    logger.info(f"Watch expired in namespace {self.namespace}, relisting")
+                    resource_version = self._relist(relist)
+                else:
+                    logger.warning(f"Watch error in namespace {self.namespace}: {e}")
+                    time.sleep(WATCH_RETRY_SECONDS)
+                    resource_version = self._relist(relist)
+            except Exception as e:
+                logger.warning(f"Watch error in namespace {self.namespace}: {e}")
+                time.sleep(WATCH_RETRY_SECONDS)
+                resource_version = self._relist(relist)
+
+    def _relist(self, relist):
+        while True:
+            try:
+                return relist()
+            except Exception as e:
+                logger.warning(f"Relist failed in namespace {self.namespace}: {e}")
+                time.sleep(WATCH_RETRY_SECONDS)
+
+    def _on_deployment_event(self, event_type, deployment):
+        name = deployment.metadata.name
+        with self.lock:
+            if event_type == "DELETED":
+                self.deployments.pop(name, None)
+                self.pods_by_deployment.pop(name, None)
+            elif event_type in ("ADDED", "MODIFIED"):
+                self.deployments[name] = deployment
+                self.pods_by_deployment[name] = {
+                    pod_name for pod_name, pod in self.pods.items()
+                    if selector_matches(deployment.spec.selector, pod.metadata.labels)
+                }
+
+    def _on_pod_event(self, event_type, pod):
+        name = pod.metadata.name
+        with self.lock:
+            for pod_names in self.pods_by_deployment.values():
+                pod_names.discard(name)
+            if event_type == "DELETED":
+                self.pods.pop(name, None)
+            elif event_type in ("ADDED", "MODIFIED"):
+                self.pods[name] = pod
+                for deployment_name, deployment in self.deployments.items():
+                    if selector_matches(deployment.spec.selector, pod.metadata.labels):
+                        self.pods_by_deployment.setdefault(deployment_name, set()).add(name)
+
+    def _rebuild_index(self):
+        self.pods_by_deployment = {
+            deployment_name: {
+                pod_name for pod_name, pod in self.pods.items()
+                if selector_matches(deployment.spec.selector, pod.metadata.labels)
+            }
+            for deployment_name, deployment in self.deployments.items()
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def enabled_for(namespace):
+    """Whether status reads for ``namespace`` go through a watch cache."""
+    return WATCH_CACHE_ENABLED and namespace in WATCH_CACHE_NAMESPACES
+
+
+def get_cache(namespace):
+    """Return the synced cache for a namespace, starting it on first use.
+
+    The initial lists run outside the global lock, so a slow namespace only
+    holds up requests for that namespace.  If they fail the next caller
+    tries again.
+    """
+    if namespace not in WATCH_CACHE_NAMESPACES:
+        raise ValueError(f"Namespace '{namespace}' is not in WATCH_CACHE_NAMESPACES")
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = NamespaceCache(namespace)
+    if not cache.synced.is_set():
+        with cache.start_lock:
+            if not cache.synced.is_set():
+                cache.start()
+    return cache
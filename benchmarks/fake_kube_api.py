@@ -0,0 +1,418 @@
+"""A small in-process stand-in for the Kubernetes API server.
+
+It implements just the endpoints this project calls (list/get/watch/create/
+patch of Deployments, Pods, Services, Secrets, ConfigMaps and Ingresses),
+counts every API call by verb and resource, and also answers ``/healthz`` so
+seeded pods can be probed by the health checker.  Good enough for load tests,
+not a conformance-grade fake.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import copy
+import datetime
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+# (api prefix, plural) -> kind
+KINDS = {
+    ("apps/v1", "deployments"): "Deployment",
+    ("v1", "pods"): "Pod",
+    ("v1", "services"): "Service",
+    ("v1", "secrets"): "Secret",
+    ("v1", "configmaps"): "ConfigMap",
+    ("networking.k8s.io/v1", "ingresses"): "Ingress",
+}
+
+PATH_RE = re.compile(
+    r"^/(?:api/(?P<core>v1)|apis/(?P<group>[^/]+/[^/]+))"
+    r"(?:/namespaces/(?P<namespace>[^/]+))?/(?P<plural>[a-z]+)(?:/(?P<name>[^/]+))?/?$"
+)
+
+START_TIME = "2024-01-01T00:00:00Z"
+
+
+def now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def precise_now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def parse_selector(selector):
+    """Equality-based label/field selector: ``a=b,c!=d,e`` -> list of (key, op, value)."""
+    terms = []
+    for term in filter(None, (selector or "").split(",")):
+        if "!=" in term:
+            key, value = term.split("!=", 1)
+            terms.append((key, "!=", value))
+        elif "=" in term:
+            key, value = term.split("=", 1)
+            terms.append((key.rstrip("="), "=", value))
+        else:
+            terms.append((term, "exists", None))
+    return terms
+
+
+def matches(terms, values):
+    for key, op, value in terms:
+        if op == "=" and values.get(key) != value:
+            return False
+        if op == "!=" and values.get(key) == value:
+            return False
+        if op == "exists" and key not in values:
+            return False
+    return True
+
+
+def field_values(obj):
+    return {
+        "metadata.name": obj["metadata"]["name"],
+        "metadata.namespace": obj["metadata"].get("namespace"),
+        "status.phase": obj.get("status", {}).get("phase"),
+    }
+
+
+class FakeKubeAPI:
+    """``rollout_step_seconds``: when set, Deployments created through the API roll out
+    like on a real cluster: their pods get scheduled, start and become ready one
+    step apart, and only then is the Deployment available.  Otherwise they are
+    available at once, with no pods.
+    """
+
+    def __init__(self, rollout_step_seconds=None):
+        self.rollout_step_seconds = rollout_step_seconds
+        self.rolling_out = set()  # (namespace, name) of Deployments whose status simulate_rollout sets
+        self.objects = {}  # (api, plural) -> {(namespace, name): object}
+        self.calls = Counter()
+        self.probes = 0
+        self.resource_version = 0
+        self.watchers = []  # (api, plural, namespace, label terms, field terms, queue)
+        self.lock = threading.Lock()
+        self.server = None
+
+    # ---- lifecycle ----
+
+    def start(self):
+        api = self
+
+        class Handler(FakeKubeHandler):
+            fake = api
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            for *_, events in self.watchers:
+                events.put(None)
+        self.server.shutdown()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def write_kubeconfig(self):
+        """Write a kubeconfig pointing at this server and return its path."""
+        kubeconfig = {
+            "apiVersion": "v1",
+            "kind": "Config",
+            "clusters": [{"name": "fake", "cluster": {"server": self.url}}],
+            "users": [{"name": "fake", "user": {"token": "fake"}}],
+            "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}],
+            "current-context": "fake",
+        }
+        fd, path = tempfile.mkstemp(prefix="fake-kubeconfig-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(kubeconfig, f)
+        return path
+
+    # ---- seeding ----
+
+    def seed(self, deployments, pods, namespace="default"):
+        """Create ``deployments`` Deployments and ``pods`` monitored pods spread across them."""
+        for d in range(deployments):
+            app = f"app-{d}"
+            self.store("apps/v1", "deployments", namespace, {
+                "apiVersion": "apps/v1",
+                "kind": "Deployment",
+                "metadata": {"name": app, "namespace": namespace, "labels": {"app": app}},
+                "spec": {
+                    "replicas": 1,
+                    "selector": {"matchLabels": {"app": app}},
+                    "template": {
+                        "metadata": {"labels": {"app": app, "monitor": "true"}},
+                        "spec": {"containers": [{"name": app, "image": "nginx"}]},
+                    },
+                },
+            })
+        for p in range(pods):
+            app = f"app-{p % max(deployments, 1)}"
+            self.store("v1", "pods", namespace, {
+                "apiVersion": "v1",
+                "kind": "Pod",
+                "metadata": {"name": f"{app}-pod-{p}", "namespace": namespace,
+                             "labels": {"app": app, "monitor": "true"}},
+                "spec": {"containers": [{"name": app, "image": "nginx",
+                                         "ports": [{"containerPort": self.port}]}]},
+                "status": {"phase": "Running", "hostIP": "127.0.0.1", "podIP": "127.0.0.1",
+                           "startTime": START_TIME},
+            })
+
+    # ---- storage ----
+
+    def next_resource_version(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def store(self, api, plural, namespace, obj, event="ADDED"):
+        with self.lock:
+            metadata = obj.setdefault("metadata", {})
+            metadata["namespace"] = namespace
+            metadata.setdefault("uid", str(uuid.uuid4()))
+            metadata.setdefault("creationTimestamp", now())
+            metadata["resourceVersion"] = self.next_resource_version()
+            if plural == "deployments" and (namespace, metadata["name"]) not in self.rolling_out:
+                replicas = obj.get("spec", {}).get("replicas", 1)
+                metadata["generation"] = 1
+                obj["status"] = {"replicas": replicas, "readyReplicas": replicas, "updatedReplicas": replicas,
+                                 "availableReplicas": replicas, "observedGeneration": 1,
+                                 "conditions": [{"type": "Available", "status": "True",
+                                                 "lastTransitionTime": metadata["creationTimestamp"]}]}
+            self.objects.setdefault((api, plural), {})[(namespace, metadata["name"])] = obj
+            self.notify(api, plural, namespace, event, obj)
+            return obj
+
+    def create_deployment(self, namespace, deployment):
+        if not self.rollout_step_seconds:
+            return self.store("apps/v1", "deployments", namespace, deployment)
+        replicas = deployment.get("spec", {}).get("replicas", 1)
+        with self.lock:
+            self.rolling_out.add((namespace, deployment["metadata"]["name"]))
+        deployment["status"] = {"replicas": replicas, "updatedReplicas": replicas, "observedGeneration": 1}
+        stored = self.store("apps/v1", "deployments", namespace, deployment)
+        self.simulate_rollout(namespace, stored)
+        return stored
+
+    def simulate_rollout(self, namespace, deployment):
+        """Roll a just created Deployment out step by step (see ``rollout_step_seconds``)."""
+        name = deployment["metadata"]["name"]
+        replicas = deployment.get("spec", {}).get("replicas", 1)
+        labels = deployment["spec"]["template"]["metadata"].get("labels", {})
+        # Pods belong to the Deployment through its ReplicaSet, named <deployment>-<pod-template-hash>
+        template_hash = uuid.uuid4().hex[:10]
+        labels = dict(labels, **{"pod-template-hash": template_hash})
+        owner = {"apiVersion": "apps/v1", "kind": "ReplicaSet", "name": f"{name}-{template_hash}",
+                 "uid": str(uuid.uuid4()), "controller": True}
+        containers = [{"name": c["name"], "image": c.get("image", "")}
+                      for c in deployment["spec"]["template"]["spec"]["containers"]]
+
+        def set_deployment_status(available):
+            status = {"replicas": replicas, "updatedReplicas": replicas,
+                      "readyReplicas": replicas if available else 0,
+                      "availableReplicas": replicas if available else 0, "observedGeneration": 1,
+                      "conditions": [{"type": "Available", "status": "True" if available else "False",
+                                      "lastTransitionTime": precise_now()}]}
+            obj = dict(self.objects[("apps/v1", "deployments")][(namespace, name)], status=status)
+            self.store("apps/v1", "deployments", namespace, obj, "MODIFIED")
+
+        def set_pod(i, phase, conditions, container_state, event):
+            self.store("v1", "pods", namespace, {
+                "apiVersion": "v1", "kind": "Pod",
+                "metadata": {"name": f"{name}-{template_hash}-{i}", "namespace": namespace, "labels": dict(labels),
+                             "ownerReferences": [owner]},
+                "spec": {"containers": containers},
+                "status": {"phase": phase, "hostIP": "127.0.0.1", "podIP": "127.0.0.1", "startTime": now(),
+                           "conditions": conditions,
+                           "containerStatuses": [{"name": c["name"], "image": c["image"], "imageID": "",
+                                                  "ready": phase == "Running", "restartCount": 0,
+                                                  "state": container_state} for c in containers]},
+            }, event)
+
+        def run():
+            step = self.rollout_step_seconds
+            time.sleep(step)
+            scheduled = {"type": "PodScheduled", "status": "True", "lastTransitionTime": precise_now()}
+            for i in range(replicas):
+                set_pod(i, "Pending", [scheduled], {"waiting": {"reason": "ContainerCreating"}}, "ADDED")
+            time.sleep(step)
+            running = {"running": {"startedAt": precise_now()}}
+            for i in range(replicas):
+                set_pod(i, "Running", [scheduled], running, "MODIFIED")
+            time.sleep(step)
+            ready = {"type": "Ready", "status": "True", "lastTransitionTime": precise_now()}
+            for i in range(replicas):
+                set_pod(i, "Running", [scheduled, ready], running, "MODIFIED")
+            set_deployment_status(available=True)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def notify(self, api, plural, namespace, event, obj):
+        for w_api, w_plural, w_namespace, labels, fields, events in self.watchers:
+            if (w_api, w_plural) == (api, plural) and w_namespace in (None, namespace) \
+                    and matches(labels, obj["metadata"].get("labels") or {}) and matches(fields, field_values(obj)):
+                events.put({"type": event, "object": obj})
+
+    def list(self, api, plural, namespace, label_selector=None, field_selector=None):
+        labels = parse_selector(label_selector)
+        fields = parse_selector(field_selector)
+        with self.lock:
+            items = [
+                obj for (ns, _), obj in sorted(self.objects.get((api, plural), {}).items())
+                if namespace in (None, ns)
+                and matches(labels, obj["metadata"].get("labels") or {})
+                and matches(fields, field_values(obj))
+            ]
+            return items, str(self.resource_version)
+
+
+class FakeKubeHandler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+    # Small keep-alive responses would otherwise wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def not_found(self, name):
+        self.send_json(404, {"kind": "Status", "apiVersion": "v1", "status": "Failure",
+                             "reason": "NotFound", "message": f"{name} not found", "code": 404})
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def route(self):
+        url = urlparse(self.path)
+        match = PATH_RE.match(url.path)
+        if not match:
+            return None
+        api = match.group("core") or match.group("group")
+        plural = match.group("plural")
+        if (api, plural) not in KINDS:
+            return None
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return api, plural, match.group("namespace"), match.group("name"), query
+
+    def count(self, verb, plural):
+        with self.fake.lock:
+            self.fake.calls[(verb, plural)] += 1
+
+    def do_GET(self):
+        if self.path.startswith("/healthz"):
+            with self.fake.lock:
+                self.fake.probes += 1
+            return self.send_json(200, {"status": "healthy"})
+
+        route = self.route()
+        if route is None:
+            return self.not_found(self.path)
+        api, plural, namespace, name, query = route
+
+        if name:
+            self.count("get", plural)
+            obj = self.fake.objects.get((api, plural), {}).get((namespace, name))
+            return self.send_json(200, obj) if obj else self.not_found(name)
+
+        if query.get("watch") in ("true", "1"):
+            self.count("watch", plural)
+            return self.watch(api, plural, namespace, query)
+
+        self.count("list", plural)
+        items, resource_version = self.fake.list(api, plural, namespace,
+                                                 query.get("labelSelector"), query.get("fieldSelector"))
+        start = int(query.get("continue") or 0)
+        limit = int(query.get("limit") or 0)
+        page = items[start:start + limit] if limit else items[start:]
+        next_start = start + len(page)
+        metadata = {"resourceVersion": resource_version}
+        if limit and next_start < len(items):
+            metadata["continue"] = str(next_start)
+        kind = KINDS[(api, plural)]
+        self.send_json(200, {"apiVersion": api, "kind": f"{kind}List", "metadata": metadata, "items": page})
+
+    def watch(self, api, plural, namespace, query):
+        events = queue.Queue()
+        watcher = (api, plural, namespace, parse_selector(query.get("labelSelector")),
+                   parse_selector(query.get("fieldSelector")), events)
+        with self.fake.lock:
+            self.fake.watchers.append(watcher)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        timeout = float(query.get("timeoutSeconds") or 300)
+        deadline = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+        try:
+            while True:
+                remaining = (deadline - datetime.datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                try:
+                    event = events.get(timeout=min(remaining, 1))
+                except queue.Empty:
+                    continue
+                if event is None:
+                    break
+                line = (json.dumps(event) + "\n").encode()
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.fake.lock:
+                self.fake.watchers.remove(watcher)
+
+    def do_POST(self):
+        route = self.route()
+        if route is None:
+            return self.not_found(self.path)
+        api, plural, namespace, _, _ = route
+        self.count("create", plural)
+        body = self.read_body()
+        name = body["metadata"]["name"]
+        if (namespace, name) in self.fake.objects.get((api, plural), {}):
+            return self.send_json(409, {"kind": "Status", "apiVersion": "v1", "status": "Failure",
+                                        "reason": "AlreadyExists", "code": 409})
+        if plural == "deployments":
+            return self.send_json(201, self.fake.create_deployment(namespace, body))
+        self.send_json(201, self.fake.store(api, plural, namespace, body))
+
+    def do_PATCH(self):
+        route = self.route()
+        if route is None:
+            return self.not_found(self.path)
+        api, plural, namespace, name, _ = route
+        self.count("patch", plural)
+        body = self.read_body()
+        existing = self.fake.objects.get((api, plural), {}).get((namespace, name))
+        if existing is None and "apply-patch" not in (self.headers.get("Content-Type") or ""):
+            return self.not_found(name)
+        # Good enough for the fake: apply and merge patches both replace the object
+        obj = copy.deepcopy(body)
+        obj.setdefault("metadata", {})["name"] = name
+        event = "ADDED" if existing is None else "MODIFIED"
+        self.send_json(200, self.fake.store(api, plural, namespace, obj, event))
@@ -0,0 +1,140 @@
+"""Load test the KaaS API and the health checker against a fake Kubernetes API server.
+
+Usage:
+    python benchmarks/run_benchmarks.py --deployments 200 --pods 600 --requests 500 --concurrency 16
+
+Every benchmark reports throughput, latency percentiles and the number of
+Kubernetes API calls per operation, as counted by the fake server.  Set
+WATCH_CACHE_ENABLED=false to measure the direct (uncached) code paths.
+The health checker's DB writes go to an in-memory sink, so no Postgres is
+needed; only listing and probing are measured.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+from fake_kube_api import FakeKubeAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NullDB:
+    """Stands in for the health checker's DB, the benchmark only measures list + probe."""
+
+    def record_results(self, results):
+        self.last_results = list(results)
+
+    def current_state(self):
+        return []
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run_load(name, operation, count, concurrency, fake):
+    """Run ``operation(i)`` ``count`` times on ``concurrency`` threads and print a result row."""
+    fake.calls.clear()
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        ok = operation(i)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    # The services print progress for every request, keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, ok in pool.map(timed, range(count)):
+            latencies.append(latency)
+            errors += 0 if ok else 1
+    elapsed = time.perf_counter() - start
+
+    api_calls = sum(fake.calls.values())
+    print(f"{name:<28} {count:>6} {count / elapsed:>10.1f} "
+          f"{percentile(latencies, 50) * 1000:>9.2f} {percentile(latencies, 95) * 1000:>9.2f} "
+          f"{percentile(latencies, 99) * 1000:>9.2f} {api_calls / count:>11.2f} {errors:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deployments", type=int, default=100)
+    parser.add_argument("--pods", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--checker-runs", type=int, default=3)
+    args = parser.parse_args()
+
+    fake = FakeKubeAPI().start()
+    fake.seed(args.deployments, args.pods)
+    os.environ["KUBECONFIG"] = fake.write_kubeconfig()
+    # Make sure neither service mistakes this machine for a cluster node
+    os.environ.pop("KUBERNETES_SERVICE_HOST", None)
+
+    sys.path.insert(0, os.path.join(ROOT, "application_files"))
+    sys.path.insert(0, os.path.join(ROOT, "health_checker"))
+    import logging
+    logging.disable(logging.INFO)
+    import app as kaas_app
+    import get_pods_status
+
+    client = kaas_app.app.test_client()
+
+    print(f"Fake API server at {fake.url}: {args.deployments} deployments, {args.pods} pods, "
+          f"watch cache {'on' if os.environ.get('WATCH_CACHE_ENABLED', 'true') == 'true' else 'off'}")
+    print(f"{'benchmark':<28} {'ops':>6} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'api calls/op':>11} {'errors':>6}")
+
+    # Warm up: first use loads the kube config and (if enabled) fills the watch cache
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.get("/deployment_status?app_name=app-0")
+
+    run_load("GET /deployment_status",
+             lambda i: client.get(f"/deployment_status?app_name=app-{i % args.deployments}").status_code == 200,
+             args.requests, args.concurrency, fake)
+    # Dashboards re-polling unchanged state: every request should end in a 304
+    etags = {i: client.get(f"/deployment_status?app_name=app-{i}").headers["ETag"]
+             for i in range(min(args.deployments, 100))}
+    run_load("GET /deployment_status 304",
+             lambda i: client.get(f"/deployment_status?app_name=app-{i % len(etags)}",
+                                  headers={"If-None-Match": etags[i % len(etags)]}).status_code == 304,
+             args.requests, args.concurrency, fake)
+    run_load("GET /all_applications",
+             lambda i: client.get("/all_applications").status_code == 200,
+             max(args.requests // 10, 1), args.concurrency, fake)
+    run_load("GET /all_applications?limit",
+             lambda i: client.get("/all_applications?limit=50").status_code == 200,
+             max(args.requests // 10, 1), args.concurrency, fake)
+
+    spec = {"ImageAddress": "nginx", "Resources": {"CPU": "100m", "RAM": "128Mi"}, "ServicePort": 80,
+            "DomainAddress": "bench.example.com",
+            "Envs": [{"Key": "MODE", "Value": "bench"}, {"Key": "TOKEN", "Value": "s3cret", "IsSecret": True}]}
+    run_load("POST /create_application",
+             lambda i: client.post("/create_application",
+                                   json=dict(spec, AppName=f"bench-{i}")).status_code == 201,
+             max(args.requests // 4, 1), args.concurrency, fake)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = NullDB()
+        results = []
+        for _ in range(args.checker_runs):
+            fake.calls.clear()
+            fake.probes = 0
+            start = time.perf_counter()
+            get_pods_status.list_pods(db=db)
+            results.append((time.perf_counter() - start, sum(fake.calls.values()), fake.probes))
+    for i, (elapsed, api_calls, probes) in enumerate(results):
+        print(f"{'health checker list_pods()':<28} run {i + 1}: {elapsed * 1000:.1f}ms, "
+              f"{api_calls} API calls, {probes} probes")
+
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import logging
+import math
+import os
+import threading
+
+from scheduler import MIN_PROBE_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Set ADAPTIVE_PROBING=false to probe every pod on its configured interval, whatever its history
+ADAPTIVE_PROBING = os.environ.get("ADAPTIVE_PROBING", "true").lower() == "true"
+# A pod counts as stable after this many successes in a row; its interval doubles with every further run of them
+PROBE_STABLE_AFTER = int(os.environ.get("PROBE_STABLE_AFTER", "10"))
+# Stable pods are probed at most this many times less often than configured
+PROBE_STABLE_MAX_FACTOR = float(os.environ.get("PROBE_STABLE_MAX_FACTOR", "4"))
+# Pods that failed within their last PROBE_STABLE_AFTER probes are probed this much more often
+PROBE_UNSTABLE_FACTOR = float(os.environ.get("PROBE_UNSTABLE_FACTOR", "0.5"))
+# Failures in a row that open a pod's circuit breaker, 0 disables the breaker
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_MAX_BACKOFF_SECONDS = float(os.environ.get("BREAKER_MAX_BACKOFF_SECONDS", "300"))
+
+if PROBE_STABLE_AFTER < 1:
+    raise ValueError(f"PROBE_STABLE_AFTER must be at least 1, got {PROBE_STABLE_AFTER}")
+if PROBE_STABLE_MAX_FACTOR < 1:
+    raise ValueError(f"PROBE_STABLE_MAX_FACTOR must be at least 1, got {PROBE_STABLE_MAX_FACTOR:g}")
+if not 0 < PROBE_UNSTABLE_FACTOR <= 1:
+    raise ValueError(f"PROBE_UNSTABLE_FACTOR must be in (0, 1], got {PROBE_UNSTABLE_FACTOR:g}")
+# Doublings a stable pod's interval can get before it reaches PROBE_STABLE_MAX_FACTOR
+MAX_STABLE_DOUBLINGS = int(math.log2(PROBE_STABLE_MAX_FACTOR))
+
+
+class TargetHistory:
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.has_failed = False
+        # Seconds until the next reopen check while the breaker is open, else None
+        self.backoff = None
+
+
+class AdaptiveProbing:
+    """Picks each target's next probe interval from its recent results.
+
+    A pod that keeps passing has its interval doubled towards
+    ``PROBE_STABLE_MAX_FACTOR`` times the configured one (whole doublings,
+    so a factor of 6 stops at 4); one that failed lately, including one
+    that flaps, is probed ``PROBE_UNSTABLE_FACTOR`` times as often until it
+    has passed ``PROBE_STABLE_AFTER`` probes in a row again.
+
+    After ``BREAKER_FAILURE_THRESHOLD`` failures in a row the pod's breaker
+    opens: instead of full probes it only gets a TCP connect to its port,
+    first after one interval and then backing off exponentially up to
+    ``BREAKER_MAX_BACKOFF_SECONDS``.  Once the port accepts connections a
+    full probe follows right away; it closes the breaker if it passes and
+    reopens it with a longer backoff if not.
+
+    Since pods are sampled unevenly, the daemon stores with every result
+    the interval it covers, and uptime is weighted by it.
+
+    Results come from the probe loop, but ``forget`` is also called by the
+    scheduler when the pod watch thread unschedules a target.
+    """
+
+    def __init__(self):
+        self.history = {}
+        self.lock = threading.Lock()
+
+    def is_open(self, key):
+        history = self.history.get(key)
+        return history is not None and history.backoff is not None
+
+    def record(self, key, success, base_interval):
+        """Account a probe result and return the interval until the next probe."""
+        with self.lock:
+            return self._record(key, success, base_interval)
+
+    def _record(self, key, success, base_interval):
+        history = self.history.setdefault(key, TargetHistory())
+        if success:
+            if history.backoff is not None:
+                logger.info(f"Circuit breaker of {key} closed, probing it again")
+            history.successes += 1
+            history.failures = 0
+            history.backoff = None
+        else:
+            history.successes = 0
+            history.failures += 1
+            history.has_failed = True
+
+        if not success and BREAKER_FAILURE_THRESHOLD and history.failures >= BREAKER_FAILURE_THRESHOLD:
+            if history.backoff is None:
+                logger.info(f"Circuit breaker of {key} opened after {history.failures} failures in a row")
+                history.backoff = base_interval
+            else:
+                history.backoff = min(history.backoff * 2, max(BREAKER_MAX_BACKOFF_SECONDS, base_interval))
+            return history.backoff
+
+        if history.has_failed and history.successes < PROBE_STABLE_AFTER:
+            return max(base_interval * PROBE_UNSTABLE_FACTOR, MIN_PROBE_INTERVAL_SECONDS)
+        doublings = min(history.successes // PROBE_STABLE_AFTER, MAX_STABLE_DOUBLINGS)
+        return base_interval * 2 ** doublings
+
+    def forget(self, key):
+        with self.lock:
+            self.history.pop(key, None)
@@ -0,0 +1,231 @@
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+from adaptive import ADAPTIVE_PROBING, AdaptiveProbing
+from monitored_pods import MONITOR_LABEL_SELECTOR, RUNNING_FIELD_SELECTOR, list_call, list_monitored_pods, namespace_label
+from prober import Prober
+from scheduler import ProbeScheduler
+
+logger = logging.getLogger(__name__)
+
+# Pods can ask for their own probe interval with this annotation, in seconds
+INTERVAL_ANNOTATION = "health-check/interval-seconds"
+DB_FLUSH_INTERVAL_SECONDS = float(os.environ.get("DB_FLUSH_INTERVAL_SECONDS", "1"))
+WATCH_TIMEOUT_SECONDS = int(os.environ.get("WATCH_TIMEOUT_SECONDS", "300"))
+WATCH_RETRY_SECONDS = 5
+MAX_IDLE_SECONDS = 1.0
+
+
+def pod_interval(pod):
+    annotations = pod.metadata.annotations or {}
+    value = annotations.get(INTERVAL_ANNOTATION)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {INTERVAL_ANNOTATION}={value!r} on pod {pod.metadata.name}")
+        return None
+
+
+class TargetWatcher:
+    """Keeps the scheduler's target set in sync with the monitored pods of one namespace.
+
+    Lists the running monitored pods once, then follows watch events,
+    relisting only when the watch expires.  ``namespace`` None watches every
+    namespace.  Several watchers can share a scheduler, each only removes
+    the targets it added.  Every monitored pod is remembered in ``pods`` but
+    only those ``owns(uid)`` accepts are scheduled, see sharding.py.
+    """
+
+    def __init__(self, namespace, scheduler, pod_target, owns=None):
+        self.namespace = namespace
+        self.scheduler = scheduler
+        self.pod_target = pod_target
+        self.owns = owns or (lambda key: True)
+        self.v1 = client.CoreV1Api()
+        self.pods = {}
+        self.keys = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        resource_version = self.relist()
+        threading.Thread(target=self.watch_loop, args=(resource_version,),
+                         name=f"watch-pods-{self.namespace or 'all'}", daemon=True).start()
+
+    def relist(self):
+        pods, resource_version = list_monitored_pods(self.v1, self.namespace)
+        seen = set()
+        for pod in pods:
+            seen.add(pod.metadata.uid)
+            self.on_event("ADDED", pod)
+        with self.lock:
+            for key in set(self.pods) - seen:
+                self.remove(key)
+        print(f"Watching {len(seen)} monitored pods in {namespace_label(self.namespace)}")
+        return resource_version
+
+    def watch_loop(self, resource_version):
+        func, args = list_call(self.v1, self.namespace)
+        while True:
+            try:
+                w = watch.Watch()
+                # A pod leaving the Running phase arrives as DELETED because of the field selector
+                for event in w.stream(func, *args,
+                                      label_selector=MONITOR_LABEL_SELECTOR,
+                                      field_selector=RUNNING_FIELD_SELECTOR,
+                                      resource_version=resource_version,
+                                      timeout_seconds=WATCH_TIMEOUT_SECONDS):
+                    pod = event["object"]
+                    resource_version = pod.metadata.resource_version
+                    self.on_event(event["type"], pod)
+            except Exception as e:
+                if not (isinstance(e, ApiException) and e.status == 410):
+                    logger.warning(f"Pod watch error in {namespace_label(self.namespace)}: {e}")
+                    time.sleep(WATCH_RETRY_SECONDS)
+                resource_version = self.safe_relist()
+
+    def safe_relist(self):
+        while True:
+            try:
+                return self.relist()
+            except Exception as e:
+                logger.warning(f"Relisting pods in {namespace_label(self.namespace)} failed: {e}")
+                time.sleep(WATCH_RETRY_SECONDS)
+
+    def on_event(self, event_type, pod):
+        key = pod.metadata.uid
+        target = None if event_type == "DELETED" else self.pod_target(pod)
+        with self.lock:
+            if target is None:
+                self.remove(key)
+            else:
+                self.pods[key] = (target, pod_interval(pod))
+                self.assign(key)
+
+    def rebalance(self):
+        """Schedule the pods this replica owns now and drop the ones it no longer does."""
+        with self.lock:
+            for key in list(self.pods):
+                self.assign(key)
+            print(f"Probing {len(self.keys)} of {len(self.pods)} monitored pods in {namespace_label(self.namespace)}")
+
+    def assign(self, key):
+        if self.owns(key):
+            target, interval = self.pods[key]
+            self.keys.add(key)
+            self.scheduler.add(key, target, time.monotonic(), interval=interval)
+        elif key in self.keys:
+            self.keys.discard(key)
+            self.scheduler.remove(key)
+
+    def remove(self, key):
+        self.pods.pop(key, None)
+        self.keys.discard(key)
+        self.scheduler.remove(key)
+
+
+class HealthCheckDaemon:
+    """Long-running checker: probes each target on its own interval.
+
+    One Prober session and one DB connection are kept for the whole life of
+    the process.  Probes are started as soon as their target is due, and their
+    results are written to the database in one batch every
+    ``DB_FLUSH_INTERVAL_SECONDS``.  Unless ADAPTIVE_PROBING is off, each
+    target's next interval and circuit breaker follow its results, see
+    adaptive.py.
+    """
+
+    def __init__(self, namespaces, db, pod_target, membership=None):
+        self.db = db
+        self.membership = membership
+        self.adaptive = AdaptiveProbing() if ADAPTIVE_PROBING else None
+        # A pod that is deleted or handed to another replica starts over if it comes back
+        self.scheduler = ProbeScheduler(on_remove=self.adaptive.forget if self.adaptive is not None else None)
+        owns = membership.owns if membership is not None else None
+        self.watchers = [TargetWatcher(namespace, self.scheduler, pod_target, owns) for namespace in namespaces]
+        self.pending = []
+        # The event loop only keeps weak references to tasks, so in-flight probes are held here
+        self.tasks = set()
+
+    def run(self):
+        if self.membership is not None:
+            self.membership.start(on_change=self.rebalance)
+        try:
+            for watcher in self.watchers:
+                watcher.start()
+            asyncio.run(self.probe_loop())
+        finally:
+            if self.membership is not None:
+                self.membership.leave()
+
+    def rebalance(self):
+        for watcher in self.watchers:
+            watcher.rebalance()
+
+    async def probe_loop(self):
+        async with Prober() as prober:
+            flusher = asyncio.create_task(self.flush_loop())
+            try:
+                while True:
+                    now = time.monotonic()
+                    for key, target in self.scheduler.pop_due(now):
+                        task = asyncio.create_task(self.probe(prober, key, target))
+                        self.tasks.add(task)
+                        task.add_done_callback(self.probe_done)
+                    await asyncio.sleep(self.scheduler.seconds_until_next(time.monotonic(), MAX_IDLE_SECONDS))
+            finally:
+                flusher.cancel()
+
+    def probe_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Probe task failed: {task.exception()!r}")
+
+    async def probe(self, prober, key, target):
+        interval = None
+        try:
+            if self.adaptive is not None and self.adaptive.is_open(key):
+                # Breaker open: don't spend a full probe until the port accepts connections again
+                result = await prober.connect(target)
+                if result.success:
+                    result = await prober.probe(target)
+            else:
+                result = await prober.probe(target)
+            base_interval = self.scheduler.interval(key)
+            if self.adaptive is not None and base_interval is not None:
+                interval = self.adaptive.record(key, result.success, base_interval)
+            # Adaptive intervals sample pods unevenly, uptime weights each result by the time it stands for
+            self.pending.append(result._replace(covers_seconds=interval or base_interval))
+        finally:
+            if not self.scheduler.reschedule(key, time.monotonic(), interval) and self.adaptive is not None:
+                # Removed while in flight: on_remove may have run before record() above
+                self.adaptive.forget(key)
+
+    async def flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(DB_FLUSH_INTERVAL_SECONDS)
+            if not self.pending:
+                continue
+            batch, self.pending = self.pending, []
+            try:
+                await loop.run_in_executor(None, self.write, batch)
+            except Exception as e:
+                logger.error(f"Dropping {len(batch)} probe results, database write failed: {e}")
+
+    def write(self, batch):
+        try:
+            self.db.record_results(batch)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection went away (pgpool restart, failover), reconnect once and retry
+            logger.warning("Database connection lost, reconnecting")
+            self.db.__connect_to_db_server__()
+            self.db.record_results(batch)
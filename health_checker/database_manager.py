@@ -1,5 +1,10 @@
+import datetime
 import json 
 import psycopg2
+from psycopg2.extras import execute_values
+
+# health_server LISTENs here for every change to a states row
+HEALTH_CHANNEL = "health_updates"
 
 class DB:
     def __init__(self) -> None:
@@ -34,37 +39,249 @@ class DB:
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # Result of the latest probe, NULL until the app has been probed since this column was added
+        mycursor.execute("ALTER TABLE states ADD COLUMN IF NOT EXISTS healthy BOOLEAN")
+        self.__create_unique_index__(mycursor)
+        # Used by the fleet summary: worst failure ratios and recent failures
+        mycursor.execute("""
+            CREATE INDEX IF NOT EXISTS states_failure_ratio_idx
+            ON states ((failure_count::float8 / NULLIF(success_count + failure_count, 0)) DESC NULLS LAST)
+        """)
+        mycursor.execute("CREATE INDEX IF NOT EXISTS states_last_failure_idx ON states (last_failure)")
+        self.__create_history_tables__(mycursor)
+        # One row per running checker replica when sharding is on, see sharding.py
+        mycursor.execute("""
+            CREATE TABLE IF NOT EXISTS checker_members (
+                member_id VARCHAR(255) PRIMARY KEY,
+                heartbeat_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.mydb.commit()
         mycursor.close()
 
+    def __create_history_tables__(self, mycursor):
+        # Append-only log of every probe, one partition per (UTC) day
+        mycursor.execute("""
+            CREATE TABLE IF NOT EXISTS probe_history (
+                app_name VARCHAR(255) NOT NULL,
+                probed_at TIMESTAMP NOT NULL,
+                success BOOLEAN NOT NULL,
+                latency_ms DOUBLE PRECISION,
+                status_code INT
+            ) PARTITION BY RANGE (probed_at)
+        """)
+        # Seconds until the target's next probe, NULL for one-shot runs
+        mycursor.execute("ALTER TABLE probe_history ADD COLUMN IF NOT EXISTS covers_seconds DOUBLE PRECISION")
+        mycursor.execute("CREATE INDEX IF NOT EXISTS probe_history_probed_at_idx ON probe_history (probed_at)")
+        # Catches rows whose day partition does not exist yet, so an insert never fails
+        mycursor.execute("CREATE TABLE IF NOT EXISTS probe_history_default PARTITION OF probe_history DEFAULT")
+
+        # Rollups written by rollup.py; latency_histogram counts successful probes per
+        # LATENCY_BUCKETS_MS bucket, index i holding width_bucket() == i
+        for table in ("probe_rollup_minute", "probe_rollup_hour"):
+            mycursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    app_name VARCHAR(255) NOT NULL,
+                    bucket TIMESTAMP NOT NULL,
+                    probe_count INT NOT NULL,
+                    success_count INT NOT NULL,
+                    latency_sum_ms DOUBLE PRECISION NOT NULL,
+                    latency_histogram INT[] NOT NULL,
+                    PRIMARY KEY (app_name, bucket)
+                )
+            """)
+            # Time-weighted uptime: seconds the probes in the bucket stand for, and how many of them were up
+            mycursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS covered_seconds DOUBLE PRECISION NOT NULL DEFAULT 0")
+            mycursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS up_seconds DOUBLE PRECISION NOT NULL DEFAULT 0")
+        mycursor.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_watermarks (
+                name VARCHAR(32) PRIMARY KEY,
+                rolled_up_to TIMESTAMP NOT NULL
+            )
+        """)
+
+        today = datetime.datetime.utcnow().date()
+        self.history_partitions = set()
+        for day in (today, today + datetime.timedelta(days=1)):
+            self.__create_history_partition__(mycursor, day)
+
+    def __create_history_partition__(self, mycursor, day):
+        if day in self.history_partitions:
+            return
+        mycursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS probe_history_{day.strftime('%Y%m%d')}
+            PARTITION OF probe_history
+            FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + datetime.timedelta(days=1)).isoformat()}')
+        """)
+        self.history_partitions.add(day)
+
+    def __create_unique_index__(self, mycursor):
+        mycursor.execute("SELECT to_regclass('states_app_name_key')")
+        if mycursor.fetchone()[0] is not None:
+            return
+        # Older deployments could insert the same app twice, fold duplicates into
+        # the oldest row before the unique index makes that impossible
+        mycursor.execute("""
+            WITH merged AS (
+                SELECT app_name,
+                       MIN(id) AS keep_id,
+                       SUM(failure_count) AS failure_count,
+                       SUM(success_count) AS success_count,
+                       MAX(last_failure) AS last_failure,
+                       MAX(last_success) AS last_success
+                FROM states
+                GROUP BY app_name
+                HAVING COUNT(*) > 1
+            ), kept AS (
+                UPDATE states SET
+                    failure_count = merged.failure_count,
+                    success_count = merged.success_count,
+                    last_failure = merged.last_failure,
+                    last_success = merged.last_success
+                FROM merged
+                WHERE states.id = merged.keep_id
+            )
+            DELETE FROM states USING merged
+            WHERE states.app_name = merged.app_name AND states.id <> merged.keep_id
+        """)
+        mycursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS states_app_name_key ON states (app_name)")
+
     def new_update(self,app_name,isSuccessfull):
         cursor = self.mydb.cursor()
+        try:
+            self.__write_states__(cursor, [(app_name, 1 if isSuccessfull else 0, 0 if isSuccessfull else 1, isSuccessfull)])
+            self.mydb.commit()
+        except Exception:
+            self.mydb.rollback()
+            raise
+        finally:
+            cursor.close()
 
-        cursor.execute(f"SELECT * FROM states where app_name = %s", [app_name])
+    def record_results(self, results):
+        """Write one probe cycle's results in a single transaction.
 
-        result = cursor.fetchall()
-        cursor = self.mydb.cursor()
-        if len(result)!=0:
-            if isSuccessfull:
-                sql = f"UPDATE states SET success_count = success_count + 1,  last_success= CURRENT_TIMESTAMP WHERE app_name= %s"
-                
-            else:
-                sql = f"UPDATE states SET failure_count = failure_count + 1,  last_failure= CURRENT_TIMESTAMP WHERE app_name= %s"
-            val = [app_name]    
-            cursor.execute(sql,val)
-        else: 
-            if isSuccessfull:
-                sql = "INSERT INTO states (app_name, success_count, last_success) VALUES (%s,1,CURRENT_TIMESTAMP)"
-
-                cursor.execute(sql, [app_name])
-                
+        ``results`` is an iterable of ``ProbeResult``.  Results for the same app
+        are folded into one ``states`` row before the multi-row upsert is sent,
+        and every result is appended to ``probe_history``.  Every updated row
+        is published on ``HEALTH_CHANNEL``; Postgres only delivers the
+        notifications if the transaction commits.
+        """
+        results = list(results)
+        counts = {}
+        latest = {}
+        for result in results:
+            successes, failures = counts.get(result.app_name, (0, 0))
+            if result.success:
+                successes += 1
             else:
-                sql = "INSERT INTO states (app_name, failure_count, last_failure) VALUES (%s,1,CURRENT_TIMESTAMP)"
+                failures += 1
+            counts[result.app_name] = (successes, failures)
+            if result.app_name not in latest or result.probed_at >= latest[result.app_name].probed_at:
+                latest[result.app_name] = result
 
-                cursor.execute(sql, [app_name])
+        if not counts:
+            return
 
-        self.mydb.commit()
+        cursor = self.mydb.cursor()
+        try:
+            self.__write_states__(cursor, [(app_name, s, f, latest[app_name].success)
+                                           for app_name, (s, f) in counts.items()])
+            self.__append_history__(cursor, results)
+            self.mydb.commit()
+        except Exception:
+            self.mydb.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def __write_states__(self, cursor, rows):
+        # rows are (app_name, success_increment, failure_increment, healthy)
+        rows = sorted(rows)
+        # Lock the rows first to read the health they had before this update; sorted
+        # so concurrent checkers always lock in the same order
+        cursor.execute("SELECT app_name, healthy FROM states WHERE app_name = ANY(%s) ORDER BY app_name FOR UPDATE",
+                       ([row[0] for row in rows],))
+        previous = dict(cursor.fetchall())
+        self.__notify_updates__(cursor, self.__upsert_counts__(cursor, rows), previous)
+
+    def __notify_updates__(self, cursor, rows, previous):
+        columns = [column.name for column in cursor.description]
+        payloads = []
+        for row in rows:
+            state = dict(zip(columns, row))
+            payloads.append(json.dumps({
+                "state": state,
+                "previous_healthy": previous.get(state["app_name"]),
+            }, default=lambda value: value.isoformat()))
+        cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload", (HEALTH_CHANNEL, payloads))
+
+    def __append_history__(self, cursor, results):
+        for day in {result.probed_at.date() for result in results}:
+            self.__create_history_partition__(cursor, day)
+        execute_values(cursor, """
+            INSERT INTO probe_history (app_name, probed_at, success, latency_ms, status_code, covers_seconds) VALUES %s
+        """, [(r.app_name, r.probed_at, r.success, r.latency * 1000, r.status_code, r.covers_seconds) for r in results],
+            page_size=len(results))
+
+    def __upsert_counts__(self, cursor, rows):
+        # Returns the updated rows, all columns
+        return execute_values(cursor, """
+            INSERT INTO states (app_name, success_count, failure_count, last_success, last_failure, healthy)
+            VALUES %s
+            ON CONFLICT (app_name) DO UPDATE SET
+                success_count = states.success_count + EXCLUDED.success_count,
+                failure_count = states.failure_count + EXCLUDED.failure_count,
+                last_success = COALESCE(EXCLUDED.last_success, states.last_success),
+                last_failure = COALESCE(EXCLUDED.last_failure, states.last_failure),
+                healthy = EXCLUDED.healthy
+            RETURNING *
+        """, [(app_name, s, f, s, f, healthy) for app_name, s, f, healthy in rows],
+            template="""(%s, %s, %s,
+                         CASE WHEN %s > 0 THEN CURRENT_TIMESTAMP END,
+                         CASE WHEN %s > 0 THEN CURRENT_TIMESTAMP END,
+                         %s)""",
+            page_size=len(rows), fetch=True)
+
+    def heartbeat(self, member_id, ttl_seconds):
+        """Mark ``member_id`` alive and return the ids of every live member, sorted.
+
+        Times come from the database clock so replicas never compare their own
+        clocks.  Members silent for ``ttl_seconds`` are considered gone; rows
+        far past that are deleted.
+        """
+        cursor = self.mydb.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO checker_members (member_id, heartbeat_at) VALUES (%s, CURRENT_TIMESTAMP)
+                ON CONFLICT (member_id) DO UPDATE SET heartbeat_at = CURRENT_TIMESTAMP
+            """, (member_id,))
+            cursor.execute("DELETE FROM checker_members WHERE heartbeat_at < CURRENT_TIMESTAMP - %s * INTERVAL '10 second'",
+                           (ttl_seconds,))
+            cursor.execute("""
+                SELECT member_id FROM checker_members
+                WHERE heartbeat_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                ORDER BY member_id
+            """, (ttl_seconds,))
+            members = [row[0] for row in cursor.fetchall()]
+            self.mydb.commit()
+            return members
+        except Exception:
+            self.mydb.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def leave(self, member_id):
+        cursor = self.mydb.cursor()
+        try:
+            cursor.execute("DELETE FROM checker_members WHERE member_id = %s", (member_id,))
+            self.mydb.commit()
+        except Exception:
+            self.mydb.rollback()
+            raise
+        finally:
+            cursor.close()
 
-        
     def current_state(self):
         cursor = self.mydb.cursor()
         cursor.execute("SELECT * FROM states")
@@ -1,34 +1,88 @@
 from kubernetes import client, config
-import requests
+import logging
+import os
+import signal
+import sys
+import time
 from database_manager import DB
-def list_pods(namespace='default'):
+from monitored_pods import configured_namespaces, list_monitored_pods, namespace_label, qualified_names, target_name
+from prober import ProbeTarget, probe_all
+
+logging.basicConfig(level=logging.INFO)
+
+def load_kube_config():
+    try:
+        config.load_incluster_config()  # If running within a Kubernetes cluster
+    except config.config_exception.ConfigException:
+        config.load_kube_config()  # Load default kubeconfig if outside cluster
+
+def list_pods(namespaces=("default",), db=None):
     # Load kube config
-    config.load_incluster_config()
-    
+    load_kube_config()
+
     # Create a v1 client
     v1 = client.CoreV1Api()
-    db = DB()
-    # List pods in the specified namespace
-    print(f"Listing pods in namespace '{namespace}' with their IPs:")
-    ret = v1.list_namespaced_pod(namespace)
-    for i in ret.items:
-        # print(i.metadata.labels.keys())
-        if "monitor" in i.metadata.labels.keys():
-            if i.metadata.labels["monitor"] == "true":
-                print(f"{i.status.pod_ip}\t{i.metadata.namespace}\t{i.metadata.name}")
-                pod_ip = i.status.pod_ip
-                port = i.spec.containers[0].ports[0].container_port
-                url = f"http://{pod_ip}:{port}/healthz"
-                try:
-                    response = requests.get(url)
-                    db.new_update(i.metadata.name,True)
-                    print(f"GET {url} response from pod {i.metadata.name}: {response.status_code} - {response.text}")
-
-                except requests.exceptions.RequestException as e:
-                    db.new_update(i.metadata.name,False)
-                    print(f"Failed to GET {url} from pod {i.metadata.name}: {str(e)}")
-        
+    if db is None:
+        db = DB()
+    targets = []
+    qualified = qualified_names(namespaces)
+    for namespace in namespaces:
+        # Only running pods labelled monitor=true come back, a page at a time
+        print(f"Listing monitored pods in {namespace_label(namespace)} with their IPs:")
+        pods, _ = list_monitored_pods(v1, namespace)
+        for i in pods:
+            print(f"{i.status.pod_ip}\t{i.metadata.namespace}\t{i.metadata.name}")
+            target = pod_target(i, qualified)
+            if target is None:
+                print(f"Skipping pod {i.metadata.name}: no pod IP or container port")
+                continue
+            targets.append(target)
+
+    # Probe the whole fleet in parallel
+    start = time.perf_counter()
+    results = probe_all(targets)
+    print(f"Probed {len(results)} pods in {time.perf_counter() - start:.2f}s")
+
+    # Store the whole cycle in one transaction
+    db.record_results(results)
+
+    for result in results:
+        if result.success:
+            print(f"GET {result.url} response from pod {result.app_name}: {result.status_code} in {result.latency * 1000:.1f}ms")
+        else:
+            print(f"Failed to GET {result.url} from pod {result.app_name} after {result.latency * 1000:.1f}ms: {result.error}")
+
     print(f"current state: \n {db.current_state()}")
-    
+
+def pod_target(pod, qualified=False):
+    pod_ip = pod.status.pod_ip
+    containers = pod.spec.containers or []
+    if not pod_ip or not containers or not containers[0].ports:
+        return None
+    port = containers[0].ports[0].container_port
+    # Stored as namespace/name when several namespaces are checked, see qualified_names()
+    return ProbeTarget(target_name(pod, qualified), f"http://{pod_ip}:{port}/healthz")
+
+def run_daemon(namespaces=("default",)):
+    # Imported here so a one-shot CronJob run doesn't pay for it
+    from daemon import HealthCheckDaemon
+    import sharding
+
+    load_kube_config()
+    membership = None
+    if sharding.SHARDING_ENABLED:
+        # Membership heartbeats get their own connection, the probe results' batches can't block them
+        membership = sharding.ShardMembership(DB())
+        print(f"Sharding enabled, joining as member '{membership.member_id}'")
+    # Exit through the normal path on SIGTERM so a sharded replica leaves the ring right away
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Starting health checker daemon for {', '.join(namespace_label(n) for n in namespaces)}")
+    qualified = qualified_names(namespaces)
+    HealthCheckDaemon(namespaces, DB(), lambda pod: pod_target(pod, qualified), membership).run()
+
 if __name__ == "__main__":
-    list_pods()
+    namespaces = configured_namespaces()
+    if "--daemon" in sys.argv or os.environ.get("MODE") == "daemon":
+        run_daemon(namespaces)
+    else:
+        list_pods(namespaces)
@@ -0,0 +1,65 @@
+import os
+
+# Filtering happens on the API server, so listing costs scale with monitored pods only
+MONITOR_LABEL_SELECTOR = "monitor=true"
+RUNNING_FIELD_SELECTOR = "status.phase=Running"
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "500"))
+ALL_NAMESPACES = "*"
+
+
+def configured_namespaces():
+    """Namespaces to check, from NAMESPACES (comma separated, or "*" for all) or NAMESPACE.
+
+    None in the returned list stands for every namespace.
+    """
+    value = os.environ.get("NAMESPACES") or os.environ.get("NAMESPACE", "default")
+    return parse_namespaces(value)
+
+
+def parse_namespaces(value):
+    namespaces = [namespace.strip() for namespace in value.split(",") if namespace.strip()]
+    if ALL_NAMESPACES in namespaces:
+        return [None]
+    return namespaces or ["default"]
+
+
+def qualified_names(namespaces):
+    """Whether results must be stored as ``namespace/name``.
+
+    Pod names are only unique within a namespace, so as soon as more than
+    one namespace is checked bare names could overwrite each other's state.
+    """
+    return len(namespaces) > 1 or None in namespaces
+
+
+def target_name(pod, qualified):
+    return f"{pod.metadata.namespace}/{pod.metadata.name}" if qualified else pod.metadata.name
+
+
+def namespace_label(namespace):
+    return "all namespaces" if namespace is None else f"namespace '{namespace}'"
+
+
+def list_call(v1, namespace):
+    """The list function and positional args for one namespace (None = all), usable for watches too."""
+    if namespace is None:
+        return v1.list_pod_for_all_namespaces, ()
+    return v1.list_namespaced_pod, (namespace,)
+
+
+def list_monitored_pods(v1, namespace):
+    """List running monitored pods page by page.
+
+    Returns ``(pods, resource_version)``; the resource version is the one
+    of the consistent snapshot all pages were served from, to start a watch.
+    """
+    func, args = list_call(v1, namespace)
+    pods = []
+    continue_token = None
+    while True:
+        ret = func(*args, label_selector=MONITOR_LABEL_SELECTOR, field_selector=RUNNING_FIELD_SELECTOR,
+                   limit=LIST_PAGE_SIZE, _continue=continue_token)
+        pods.extend(ret.items)
+        continue_token = ret.metadata._continue
+        if not continue_token:
+            return pods, ret.metadata.resource_version
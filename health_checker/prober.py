@@ -0,0 +1,96 @@
+import asyncio
+import collections
+import datetime
+import os
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", "100"))
+PROBE_CONNECT_TIMEOUT = float(os.environ.get("PROBE_CONNECT_TIMEOUT", "2"))
+PROBE_READ_TIMEOUT = float(os.environ.get("PROBE_READ_TIMEOUT", "5"))
+
+# One health check target: the app name the result is stored under and the URL to GET
+ProbeTarget = collections.namedtuple("ProbeTarget", ["app_name", "url"])
+
+# Outcome of a single probe. latency is in seconds and is measured for failures too,
+# probed_at is the (naive, UTC) time the probe started. covers_seconds is how long the
+# result stands for, i.e. the interval until the target's next probe (None if unknown).
+ProbeResult = collections.namedtuple(
+    "ProbeResult", ["app_name", "url", "success", "status_code", "latency", "error", "probed_at", "covers_seconds"],
+    defaults=[None]
+)
+
+
+class Prober:
+    """Probes many targets concurrently over one keep-alive HTTP session.
+
+    At most ``concurrency`` probes are in flight at once.  Every probe has its
+    own connect and read timeout, so a hung pod only costs its own slot.
+    Use it as ``async with Prober() as prober: await prober.probe_all(targets)``.
+    """
+
+    def __init__(self, concurrency=PROBE_CONCURRENCY, connect_timeout=PROBE_CONNECT_TIMEOUT,
+                 read_timeout=PROBE_READ_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(
+            total=connect_timeout + read_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def probe(self, target):
+        async with self.semaphore:
+            probed_at = datetime.datetime.utcnow()
+            start = time.perf_counter()
+            try:
+                async with self.session.get(target.url) as response:
+                    await response.read()
+                    latency = time.perf_counter() - start
+                    # Same rule as a kubelet httpGet probe: 2xx and 3xx are healthy
+                    success = 200 <= response.status < 400
+                    return ProbeResult(target.app_name, target.url, success, response.status, latency,
+                                       None if success else f"HTTP {response.status}", probed_at)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                latency = time.perf_counter() - start
+                return ProbeResult(target.app_name, target.url, False, None, latency,
+                                   str(e) or e.__class__.__name__, probed_at)
+
+    async def connect(self, target):
+        """Cheap liveness check: only open (and close) a TCP connection to the target's port."""
+        url = urlparse(target.url)
+        async with self.semaphore:
+            probed_at = datetime.datetime.utcnow()
+            start = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(url.hostname, url.port or 80),
+                                                   self.timeout.sock_connect)
+                writer.close()
+                return ProbeResult(target.app_name, target.url, True, None, time.perf_counter() - start, None, probed_at)
+            except (OSError, asyncio.TimeoutError) as e:
+                return ProbeResult(target.app_name, target.url, False, None, time.perf_counter() - start,
+                                   f"connect failed: {str(e) or e.__class__.__name__}", probed_at)
+
+    async def probe_all(self, targets):
+        return await asyncio.gather(*(self.probe(target) for target in targets))
+
+
+def probe_all(targets, **kwargs):
+    """Probe every target in parallel and return their results in the same order."""
+    async def run():
+        async with Prober(**kwargs) as prober:
+            return await prober.probe_all(targets)
+
+    return asyncio.run(run())
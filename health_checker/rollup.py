@@ -0,0 +1,178 @@
+import datetime
+import os
+from collections import defaultdict
+from psycopg2.extras import execute_values
+from database_manager import DB
+
+# Upper bounds (ms) of the latency histogram buckets; health_server reads the
+# histograms back with the same bounds, keep both lists in sync
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+HISTOGRAM_SIZE = len(LATENCY_BUCKETS_MS) + 1
+
+# Raw rows younger than this may still be in flight from a checker, don't roll them up yet
+ROLLUP_LAG_SECONDS = int(os.environ.get("ROLLUP_LAG_SECONDS", "60"))
+RAW_RETENTION_DAYS = int(os.environ.get("RAW_RETENTION_DAYS", "7"))
+MINUTE_RETENTION_DAYS = int(os.environ.get("MINUTE_RETENTION_DAYS", "30"))
+# Maximum span rolled up per statement, keeps memory flat after a long outage
+ROLLUP_CHUNK = datetime.timedelta(hours=1)
+
+
+def truncate(ts, unit):
+    if unit == "minute":
+        return ts.replace(second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def get_watermark(cursor, name):
+    cursor.execute("SELECT rolled_up_to FROM rollup_watermarks WHERE name = %s", [name])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cursor, name, rolled_up_to):
+    cursor.execute("""
+        INSERT INTO rollup_watermarks (name, rolled_up_to) VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE SET rolled_up_to = EXCLUDED.rolled_up_to
+    """, [name, rolled_up_to])
+
+
+def upsert_rollups(cursor, table, rows):
+    # rows are (app_name, bucket, probe_count, success_count, latency_sum_ms, latency_histogram,
+    #           covered_seconds, up_seconds)
+    if not rows:
+        return
+    execute_values(cursor, f"""
+        INSERT INTO {table} (app_name, bucket, probe_count, success_count, latency_sum_ms, latency_histogram,
+                             covered_seconds, up_seconds)
+        VALUES %s
+        ON CONFLICT (app_name, bucket) DO UPDATE SET
+            probe_count = EXCLUDED.probe_count,
+            success_count = EXCLUDED.success_count,
+            latency_sum_ms = EXCLUDED.latency_sum_ms,
+            latency_histogram = EXCLUDED.latency_histogram,
+            covered_seconds = EXCLUDED.covered_seconds,
+            up_seconds = EXCLUDED.up_seconds
+    """, rows, page_size=1000)
+
+
+def rollup_minutes(db, now):
+    cursor = db.mydb.cursor()
+    start = get_watermark(cursor, "minute")
+    if start is None:
+        cursor.execute("SELECT MIN(probed_at) FROM probe_history")
+        first = cursor.fetchone()[0]
+        if first is None:
+            return
+        start = truncate(first, "minute")
+    end = truncate(now - datetime.timedelta(seconds=ROLLUP_LAG_SECONDS), "minute")
+
+    while start < end:
+        chunk_end = min(start + ROLLUP_CHUNK, end)
+        cursor.execute("""
+            SELECT app_name,
+                   date_trunc('minute', probed_at) AS bucket,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE success),
+                   COALESCE(SUM(latency_ms) FILTER (WHERE success), 0),
+                   array_agg(width_bucket(latency_ms, %s::double precision[])) FILTER (WHERE success),
+                   COALESCE(SUM(covers_seconds), 0),
+                   COALESCE(SUM(covers_seconds) FILTER (WHERE success), 0)
+            FROM probe_history
+            WHERE probed_at >= %s AND probed_at < %s
+            GROUP BY 1, 2
+        """, [LATENCY_BUCKETS_MS, start, chunk_end])
+        rows = []
+        for app_name, bucket, probe_count, success_count, latency_sum, bins, covered, up in cursor.fetchall():
+            histogram = [0] * HISTOGRAM_SIZE
+            for i in bins or ():
+                histogram[i] += 1
+            rows.append((app_name, bucket, probe_count, success_count, latency_sum, histogram, covered, up))
+        upsert_rollups(cursor, "probe_rollup_minute", rows)
+        set_watermark(cursor, "minute", chunk_end)
+        db.mydb.commit()
+        print(f"Rolled up {len(rows)} minute buckets for [{start}, {chunk_end})")
+        start = chunk_end
+    cursor.close()
+
+
+def rollup_hours(db):
+    cursor = db.mydb.cursor()
+    minute_watermark = get_watermark(cursor, "minute")
+    if minute_watermark is None:
+        return
+    start = get_watermark(cursor, "hour")
+    if start is None:
+        cursor.execute("SELECT MIN(bucket) FROM probe_rollup_minute")
+        first = cursor.fetchone()[0]
+        if first is None:
+            return
+        start = truncate(first, "hour")
+    # Only close hours whose every minute has been rolled up
+    end = truncate(minute_watermark, "hour")
+
+    while start < end:
+        chunk_end = min(start + datetime.timedelta(hours=24), end)
+        cursor.execute("""
+            SELECT app_name, date_trunc('hour', bucket), probe_count, success_count, latency_sum_ms, latency_histogram,
+                   covered_seconds, up_seconds
+            FROM probe_rollup_minute
+            WHERE bucket >= %s AND bucket < %s
+        """, [start, chunk_end])
+        totals = defaultdict(lambda: [0, 0, 0.0, [0] * HISTOGRAM_SIZE, 0.0, 0.0])
+        for app_name, hour, probe_count, success_count, latency_sum, histogram, covered, up in cursor.fetchall():
+            total = totals[(app_name, hour)]
+            total[0] += probe_count
+            total[1] += success_count
+            total[2] += latency_sum
+            total[3] = [a + b for a, b in zip(total[3], histogram)]
+            total[4] += covered
+            total[5] += up
+        rows = [(app_name, hour, *total) for (app_name, hour), total in totals.items()]
+        upsert_rollups(cursor, "probe_rollup_hour", rows)
+        set_watermark(cursor, "hour", chunk_end)
+        db.mydb.commit()
+        print(f"Rolled up {len(rows)} hour buckets for [{start}, {chunk_end})")
+        start = chunk_end
+    cursor.close()
+
+
+def maintain_partitions(db, now):
+    cursor = db.mydb.cursor()
+    today = now.date()
+    # Create upcoming partitions here rather than on the write path
+    for day in (today, today + datetime.timedelta(days=1), today + datetime.timedelta(days=2)):
+        db.__create_history_partition__(cursor, day)
+
+    minute_watermark = get_watermark(cursor, "minute")
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE parent.relname = 'probe_history' AND child.relname ~ '^probe_history_[0-9]{8}$'
+    """)
+    cutoff = today - datetime.timedelta(days=RAW_RETENTION_DAYS)
+    for (partition,) in cursor.fetchall():
+        day = datetime.datetime.strptime(partition[-8:], "%Y%m%d").date()
+        day_end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+        # Never drop raw rows that have not been rolled up yet
+        if day < cutoff and minute_watermark is not None and day_end <= minute_watermark:
+            cursor.execute(f"DROP TABLE IF EXISTS {partition}")
+            print(f"Dropped raw probe partition {partition}")
+
+    cursor.execute("DELETE FROM probe_rollup_minute WHERE bucket < %s",
+                   [now - datetime.timedelta(days=MINUTE_RETENTION_DAYS)])
+    db.mydb.commit()
+    cursor.close()
+
+
+def run_rollups():
+    db = DB()
+    now = datetime.datetime.utcnow()
+    rollup_minutes(db, now)
+    rollup_hours(db)
+    maintain_partitions(db, now)
+
+
+if __name__ == "__main__":
+    run_rollups()
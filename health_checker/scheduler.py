@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+
+PROBE_INTERVAL_SECONDS = float(os.environ.get("PROBE_INTERVAL_SECONDS", "30"))
+# Each interval is stretched or shrunk by up to this fraction so targets drift apart
+PROBE_JITTER = float(os.environ.get("PROBE_JITTER", "0.1"))
+MIN_PROBE_INTERVAL_SECONDS = 1.0
+
+
+class ProbeScheduler:
+    """Keeps every target on its own probe interval.
+
+    Targets live in a min-heap ordered by their next due time.  A target is
+    taken off the heap while it is being probed and put back by
+    ``reschedule`` once its result is in, so it is never probed twice at
+    once.  Every key has at most one live heap entry; removed or superseded
+    entries are dropped lazily when they reach the top.
+    Safe to use from the pod watch thread and the probe loop at the same time.
+    ``on_remove(key)`` is called, outside the lock, for every target removed.
+    """
+
+    def __init__(self, default_interval=PROBE_INTERVAL_SECONDS, jitter=PROBE_JITTER, on_remove=None):
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.on_remove = on_remove
+        self.targets = {}
+        self.intervals = {}
+        self.heap = []
+        self.entries = {}
+        self.in_flight = set()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, key, target, now, interval=None):
+        interval = max(interval or self.default_interval, MIN_PROBE_INTERVAL_SECONDS)
+        with self.lock:
+            is_new = key not in self.targets
+            self.targets[key] = target
+            self.intervals[key] = interval
+            if is_new and key not in self.in_flight:
+                # Spread new targets over their first interval instead of probing them all at once
+                self._push(key, now + random.uniform(0, interval))
+
+    def remove(self, key):
+        with self.lock:
+            removed = self.targets.pop(key, None) is not None
+            self.intervals.pop(key, None)
+            self.entries.pop(key, None)
+        if removed and self.on_remove is not None:
+            self.on_remove(key)
+
+    def keys(self):
+        with self.lock:
+            return list(self.targets)
+
+    def pop_due(self, now):
+        """Return (key, target) for every target due at ``now`` and mark them in flight."""
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, seq, key = heapq.heappop(self.heap)
+                if self.entries.get(key) == seq:
+                    del self.entries[key]
+                    self.in_flight.add(key)
+                    due.append((key, self.targets[key]))
+        return due
+
+    def interval(self, key):
+        """The interval the target was added with, None once it was removed."""
+        with self.lock:
+            return self.intervals.get(key)
+
+    def reschedule(self, key, now, interval=None):
+        """Put a probed target back on the heap; False if it was removed meanwhile."""
+        with self.lock:
+            self.in_flight.discard(key)
+            if key not in self.targets:
+                return False
+            if interval is None:
+                interval = self.intervals[key]
+            self._push(key, now + self._jittered(interval))
+            return True
+
+    def seconds_until_next(self, now, max_wait):
+        with self.lock:
+            if not self.heap:
+                return max_wait
+            return min(max(self.heap[0][0] - now, 0), max_wait)
+
+    def _jittered(self, interval):
+        return max(interval * random.uniform(1 - self.jitter, 1 + self.jitter), MIN_PROBE_INTERVAL_SECONDS)
+
+    def _push(self, key, due):
+        seq = next(self.counter)
+        self.entries[key] = seq
+        heapq.heappush(self.heap, (due, seq, key))
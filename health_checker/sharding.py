@@ -0,0 +1,111 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Run several daemon replicas with SHARDING_ENABLED=true and each probes its own share of the pods
+SHARDING_ENABLED = os.environ.get("SHARDING_ENABLED", "false").lower() == "true"
+SHARD_HEARTBEAT_SECONDS = float(os.environ.get("SHARD_HEARTBEAT_SECONDS", "5"))
+# A replica that hasn't heartbeated for this long is dropped from the ring
+SHARD_MEMBER_TTL_SECONDS = float(os.environ.get("SHARD_MEMBER_TTL_SECONDS", "15"))
+SHARD_VIRTUAL_NODES = int(os.environ.get("SHARD_VIRTUAL_NODES", "128"))
+# POD_NAME comes from the downward API in daemon.yaml
+MEMBER_ID = os.environ.get("POD_NAME") or socket.gethostname()
+
+
+def ring_hash(value):
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring with ``virtual_nodes`` points per member.
+
+    When a member joins or leaves only the keys next to its points move,
+    about 1/N of them, and the virtual nodes keep the shares even.
+    """
+
+    def __init__(self, members, virtual_nodes=SHARD_VIRTUAL_NODES):
+        self.members = tuple(sorted(members))
+        points = sorted((ring_hash(f"{member}#{i}"), member)
+                        for member in self.members for i in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self.hashes:
+            return None
+        i = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.owners[i]
+
+
+class ShardMembership:
+    """This replica's membership in the checker group, kept in the ``checker_members`` table.
+
+    A background thread heartbeats every ``SHARD_HEARTBEAT_SECONDS`` and
+    rebuilds the ring whenever the set of live members changes, calling
+    ``on_change`` so the daemon can pick up or drop targets.  If heartbeats
+    keep failing for longer than the TTL the others have already taken our
+    pods, so this replica owns nothing until it gets through again.
+    ``db`` should be a DB used only for membership.
+    """
+
+    def __init__(self, db, member_id=MEMBER_ID):
+        self.db = db
+        self.member_id = member_id
+        self.ring = HashRing([])
+        self.last_heartbeat = None
+        self.on_change = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, on_change):
+        self.on_change = on_change
+        # First heartbeat before any target is scheduled, so we start with the real ring
+        self.heartbeat()
+        threading.Thread(target=self.heartbeat_loop, name="shard-heartbeat", daemon=True).start()
+
+    def owns(self, key):
+        with self.lock:
+            return self.ring.owner(key) == self.member_id
+
+    def heartbeat_loop(self):
+        while not self.stopped.wait(SHARD_HEARTBEAT_SECONDS):
+            self.heartbeat()
+
+    def heartbeat(self):
+        try:
+            members = self.db.heartbeat(self.member_id, SHARD_MEMBER_TTL_SECONDS)
+            self.last_heartbeat = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Shard heartbeat failed: {e}")
+            members = None
+            try:
+                self.db.__connect_to_db_server__()
+            except Exception:
+                pass
+            if self.last_heartbeat is None or time.monotonic() - self.last_heartbeat > SHARD_MEMBER_TTL_SECONDS:
+                members = []
+        if members is not None:
+            self.update(members)
+
+    def update(self, members):
+        with self.lock:
+            if tuple(sorted(members)) == self.ring.members:
+                return
+            self.ring = HashRing(members)
+        logger.info(f"Checker {self.member_id}: {len(members)} live members {members}, rebalancing")
+        if self.on_change is not None:
+            self.on_change()
+
+    def leave(self):
+        """Drop out of the ring right away so the others take over without waiting for the TTL."""
+        self.stopped.set()
+        try:
+            self.db.leave(self.member_id)
+        except Exception as e:
+            logger.warning(f"Leaving the checker group failed: {e}")
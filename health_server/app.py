@@ -1,17 +1,182 @@
-from flask import Flask, jsonify
+import datetime
+import json
+import os
+import queue
+from flask import Flask, Response, jsonify, request, stream_with_context
 from database_manager import DB
+from cache import TTLCache
+from live_view import HEALTH_VIEW_ENABLED, HealthView
+import profiling
+from stats import histogram_percentile, merge_rollups, parse_window
+
+HEALTH_CACHE_TTL_SECONDS = float(os.environ.get("HEALTH_CACHE_TTL_SECONDS", "2"))
+HEALTH_CACHE_MAX_SIZE = int(os.environ.get("HEALTH_CACHE_MAX_SIZE", "10000"))
+# Comment lines sent on an idle event stream so proxies don't close it
+EVENT_STREAM_KEEPALIVE_SECONDS = float(os.environ.get("EVENT_STREAM_KEEPALIVE_SECONDS", "15"))
+HEALTH_BULK_MAX_APPS = int(os.environ.get("HEALTH_BULK_MAX_APPS", "1000"))
 
 app = Flask(__name__)
+# Per-request profiles and /debug/profiler, only with PROFILING_ENABLED=true.
+# profiling.py lives in application_files/, the Dockerfile copies it next to this file.
+profiling.install(app)
+
+# Opens the connection pool and sets up the schema once, at startup
+db = DB()
+app_info_cache = TTLCache(max_size=HEALTH_CACHE_MAX_SIZE, ttl=HEALTH_CACHE_TTL_SECONDS)
+# Latest state of every app, pushed by the health checker through LISTEN/NOTIFY
+health_view = HealthView(db)
+if HEALTH_VIEW_ENABLED:
+    health_view.start()
+
+def get_app_info(app_name):
+    if health_view.synced.is_set():
+        # The view holds every row, an app missing from it has no row in the table either
+        state = health_view.get(app_name)
+        return [list(state.values())] if state else []
+    found, result = app_info_cache.get(app_name)
+    if not found:
+        result = db.get_app_info(app_name)
+        app_info_cache.put(app_name, result)
+    return result
+
+def get_apps_info(app_names):
+    if health_view.synced.is_set():
+        states = {app_name: health_view.get(app_name) for app_name in app_names}
+        return {app_name: [list(state.values())] if state else [] for app_name, state in states.items()}
+    return db.get_apps_info(app_names)
 
-@app.route('/health/<string:app_name>', methods=['GET'])
+@app.route('/health/<path:app_name>', methods=['GET'])
 def health_check(app_name):
-    db = DB()
-    result = db.get_app_info(app_name)
+    result = get_app_info(app_name)
     response = {
         "app_name": app_name,
         "result": result
     }
     return jsonify(response), 200
 
+@app.route('/health_bulk', methods=['GET', 'POST'])
+def health_bulk():
+    """``/health/<app_name>`` for many apps at once: ?app=a&app=b, ?apps=a,b or a POSTed {"apps": [...]}."""
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        app_names = body.get('apps')
+        if not isinstance(app_names, list) or not all(isinstance(name, str) for name in app_names):
+            return jsonify({"error": "Expected a JSON body like {\"apps\": [\"app-1\", \"app-2\"]}"}), 400
+    else:
+        app_names = request.args.getlist('app') + [
+            name for value in request.args.getlist('apps') for name in value.split(',') if name]
+    app_names = list(dict.fromkeys(app_names))
+    if not app_names:
+        return jsonify({"error": "No app names given"}), 400
+    if len(app_names) > HEALTH_BULK_MAX_APPS:
+        return jsonify({"error": f"At most {HEALTH_BULK_MAX_APPS} apps per request"}), 400
+
+    results = get_apps_info(app_names)
+    response = {
+        "apps": [{"app_name": app_name, "result": results[app_name]} for app_name in app_names]
+    }
+    return jsonify(response), 200
+
+@app.route('/health_summary', methods=['GET'])
+def health_summary():
+    try:
+        top = int(request.args.get('top', '10'))
+        min_probes = int(request.args.get('min_probes', '1'))
+        stale_after = parse_window(request.args.get('stale_after', '5m'))
+        window = parse_window(request.args.get('window', '1h'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if top < 0 or top > HEALTH_BULK_MAX_APPS:
+        return jsonify({"error": f"'top' must be between 0 and {HEALTH_BULK_MAX_APPS}"}), 400
+
+    summary = db.get_summary(top, min_probes, stale_after.total_seconds(), window.total_seconds())
+    summary["stale_after_seconds"] = int(stale_after.total_seconds())
+    summary["window_seconds"] = int(window.total_seconds())
+    return jsonify(summary), 200
+
+@app.route('/health/<path:app_name>/uptime', methods=['GET'])
+def uptime(app_name):
+    try:
+        window = parse_window(request.args.get('window', '24h'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start = datetime.datetime.utcnow() - window
+    probe_count, success_count, _, covered_seconds, up_seconds = merge_rollups(db.get_rollups(app_name, start))
+    # The daemon probes stable pods less and failing ones more often, so each probe is weighted by the
+    # time until the next one. Only probes without that (one-shot CronJob runs, older rows) are counted.
+    if covered_seconds:
+        uptime_percent, basis = round(100 * up_seconds / covered_seconds, 3), "time"
+    elif probe_count:
+        uptime_percent, basis = round(100 * success_count / probe_count, 3), "probes"
+    else:
+        uptime_percent, basis = None, None
+    response = {
+        "app_name": app_name,
+        "window_seconds": int(window.total_seconds()),
+        "probe_count": probe_count,
+        "success_count": success_count,
+        "covered_seconds": round(covered_seconds, 3),
+        "uptime_percent": uptime_percent,
+        "uptime_basis": basis
+    }
+    return jsonify(response), 200
+
+@app.route('/health/<path:app_name>/latency', methods=['GET'])
+def latency(app_name):
+    try:
+        window = parse_window(request.args.get('window', '24h'))
+        percentiles = [float(p) for p in request.args.get('percentiles', '50,95,99').split(',')]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if any(p < 0 or p > 100 for p in percentiles):
+        return jsonify({"error": "Percentiles must be between 0 and 100"}), 400
+
+    start = datetime.datetime.utcnow() - window
+    _, success_count, histogram, _, _ = merge_rollups(db.get_rollups(app_name, start))
+    response = {
+        "app_name": app_name,
+        "window_seconds": int(window.total_seconds()),
+        "sample_count": success_count,
+        "latency_ms": {f"p{p:g}": histogram_percentile(histogram, p) for p in percentiles}
+    }
+    return jsonify(response), 200
+
+@app.route('/health_events', methods=['GET'])
+def health_events():
+    """Server-Sent Events stream of health transitions, optionally only for ?app=... apps."""
+    if not HEALTH_VIEW_ENABLED:
+        return jsonify({"error": "Health event streaming is disabled"}), 503
+
+    app_names = request.args.getlist('app')
+    subscriber = health_view.subscribe(app_names)
+
+    def stream():
+        try:
+            # Start with the current state of the apps asked for, then only changes
+            for app_name in app_names:
+                state = health_view.get(app_name)
+                if state is not None:
+                    data = {"app_name": app_name, "healthy": state.get("healthy"),
+                            "success_count": state["success_count"], "failure_count": state["failure_count"]}
+                    yield f"event: state\ndata: {json.dumps(data)}\n\n"
+            while not subscriber.overflowed:
+                try:
+                    event_id, data = subscriber.events.get(timeout=EVENT_STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event_id}\nevent: transition\ndata: {json.dumps(data)}\n\n"
+            # Fell too far behind, the client should reconnect and re-read the current state
+            yield "event: overflow\ndata: {}\n\n"
+        finally:
+            health_view.unsubscribe(subscriber)
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True,host='0.0.0.0', port=5000)
@@ -1,7 +1,30 @@
+import datetime
 import json 
+import os
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+DB_POOL_MIN_CONNECTIONS = int(os.environ.get("DB_POOL_MIN_CONNECTIONS", "1"))
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get("DB_POOL_MAX_CONNECTIONS", "10"))
+# How long a request waits for a free pooled connection before failing
+DB_POOL_WAIT_SECONDS = float(os.environ.get("DB_POOL_WAIT_SECONDS", "10"))
+# The health checker publishes every change to a states row here
+HEALTH_CHANNEL = "health_updates"
 
 class DB:
+    """Process-wide access to the health database.
+
+    Every DB() shares one connection pool; the pool is opened and the schema
+    is set up only when the first instance is created.  The pool itself
+    raises when it is exhausted, so ``slots`` makes callers queue for a
+    connection instead.
+    """
+    pool = None
+    pool_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+
     def __init__(self) -> None:
         dbname = "kaas"
         user = "postgres"
@@ -11,44 +34,225 @@ class DB:
 
         self.conn_string = f"dbname='{dbname}' user='{user}' password='{password}' host='{host}' port='{port}'"
 
-        self.__connect_to_db_server__()
-        
-        self.__create_table__()
+        with DB.pool_lock:
+            if DB.pool is None:
+                pool = self.__connect_to_db_server__()
+                try:
+                    self.__create_table__(pool)
+                except Exception:
+                    pool.closeall()
+                    raise
+                # Shared only once the schema is in place, so a failed setup is retried by the next DB()
+                DB.pool = pool
 
 
     def __connect_to_db_server__(self):
         
-        self.mydb = psycopg2.connect(self.conn_string)
+        return ThreadedConnectionPool(DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS, self.conn_string)
+
+    @contextmanager
+    def connection(self, pool=None):
+        pool = pool or DB.pool
+        if not DB.slots.acquire(timeout=DB_POOL_WAIT_SECONDS):
+            raise PoolError(f"No database connection free after {DB_POOL_WAIT_SECONDS:g}s")
+        try:
+            conn = pool.getconn()
+            broken = False
+            try:
+                if not conn.autocommit:
+                    # Reads only, don't leave pooled connections idle in a transaction
+                    conn.autocommit = True
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                pool.putconn(conn, close=broken or conn.closed != 0)
+        finally:
+            DB.slots.release()
     
 
-    def __create_table__(self):
-        mycursor = self.mydb.cursor()
-        mycursor.execute("""
-            CREATE TABLE IF NOT EXISTS states (
-                id SERIAL PRIMARY KEY, 
-                app_name VARCHAR(255), 
-                failure_count INT DEFAULT 0, 
-                success_count INT DEFAULT 0, 
-                last_failure TIMESTAMP, 
-                last_success TIMESTAMP, 
-                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        mycursor.close()
+    def __create_table__(self, pool=None):
+        with self.connection(pool) as conn:
+            mycursor = conn.cursor()
+            mycursor.execute("""
+                CREATE TABLE IF NOT EXISTS states (
+                    id SERIAL PRIMARY KEY, 
+                    app_name VARCHAR(255), 
+                    failure_count INT DEFAULT 0, 
+                    success_count INT DEFAULT 0, 
+                    last_failure TIMESTAMP, 
+                    last_success TIMESTAMP, 
+                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            mycursor.execute("ALTER TABLE states ADD COLUMN IF NOT EXISTS healthy BOOLEAN")
+            # Used by the fleet summary: worst failure ratios and recent failures
+            mycursor.execute("""
+                CREATE INDEX IF NOT EXISTS states_failure_ratio_idx
+                ON states ((failure_count::float8 / NULLIF(success_count + failure_count, 0)) DESC NULLS LAST)
+            """)
+            mycursor.execute("CREATE INDEX IF NOT EXISTS states_last_failure_idx ON states (last_failure)")
+            # Written by the health checker's rollup job, created here too so reads
+            # work before the first rollup has run
+            for table in ("probe_rollup_minute", "probe_rollup_hour"):
+                mycursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        app_name VARCHAR(255) NOT NULL,
+                        bucket TIMESTAMP NOT NULL,
+                        probe_count INT NOT NULL,
+                        success_count INT NOT NULL,
+                        latency_sum_ms DOUBLE PRECISION NOT NULL,
+                        latency_histogram INT[] NOT NULL,
+                        PRIMARY KEY (app_name, bucket)
+                    )
+                """)
+                mycursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS covered_seconds DOUBLE PRECISION NOT NULL DEFAULT 0")
+                mycursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS up_seconds DOUBLE PRECISION NOT NULL DEFAULT 0")
+            mycursor.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_watermarks (
+                    name VARCHAR(32) PRIMARY KEY,
+                    rolled_up_to TIMESTAMP NOT NULL
+                )
+            """)
+            mycursor.close()
 
     def get_app_info(self,app_name):
-        cursor = self.mydb.cursor()
-        cursor.execute(f"SELECT * FROM states where app_name = %s",[app_name])
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM states where app_name = %s",[app_name])
 
-        myresult = cursor.fetchall()
+            myresult = cursor.fetchall()
+            cursor.close()
         return myresult
 
-        
-    def current_state(self):
-        cursor = self.mydb.cursor()
+    def get_apps_info(self, app_names):
+        """``get_app_info`` for many apps in one query, as {app_name: rows}."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Uses the unique index on app_name the health checker creates
+            cursor.execute("SELECT * FROM states WHERE app_name = ANY(%s)", [list(app_names)])
+            myresult = {app_name: [] for app_name in app_names}
+            for row in cursor.fetchall():
+                myresult[row[1]].append(row)
+            cursor.close()
+        return myresult
+
+    def get_summary(self, top, min_probes, stale_after_seconds, window_seconds):
+        """Fleet-wide health counts and the apps with the worst failure ratio.
+
+        An app is stale when it hasn't been probed for ``stale_after_seconds``;
+        ``failed_in_window`` counts apps with a failure in the last
+        ``window_seconds``.  Only apps with at least ``min_probes`` probes
+        can be worst offenders.  The failure ratio counts probes: with adaptive
+        probing failing pods are probed more often, so it is not a share of time
+        (the uptime endpoint is).
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*),
+                       COUNT(*) FILTER (WHERE healthy),
+                       COUNT(*) FILTER (WHERE NOT healthy),
+                       COUNT(*) FILTER (WHERE healthy IS NULL),
+                       COUNT(*) FILTER (WHERE GREATEST(last_success, last_failure) IS NULL
+                                        OR GREATEST(last_success, last_failure) < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                FROM states
+            """, [stale_after_seconds])
+            total, healthy, unhealthy, unknown, stale = cursor.fetchone()
+
+            cursor.execute("SELECT COUNT(*) FROM states WHERE last_failure >= CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+                           [window_seconds])
+            failed_in_window = cursor.fetchone()[0]
+
+            # Same expression as states_failure_ratio_idx, so this is an index scan stopping after ``top`` rows
+            cursor.execute("""
+                SELECT app_name, failure_count::float8 / NULLIF(success_count + failure_count, 0) AS failure_ratio,
+                       success_count, failure_count, healthy, last_failure
+                FROM states
+                WHERE success_count + failure_count >= %s
+                ORDER BY failure_count::float8 / NULLIF(success_count + failure_count, 0) DESC NULLS LAST, app_name
+                LIMIT %s
+            """, [min_probes, top])
+            columns = [column.name for column in cursor.description]
+            worst = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.close()
+
+        return {
+            "total": total,
+            "healthy": healthy,
+            "unhealthy": unhealthy,
+            "unknown": unknown,
+            "stale": stale,
+            "failed_in_window": failed_in_window,
+            "worst_offenders": worst,
+        }
+
+    def get_rollups(self, app_name, start):
+        """Return (probe_count, success_count, latency_histogram, covered_seconds, up_seconds) rows covering [start, now).
+
+        Whole hours that the hour rollup already covers are read from
+        ``probe_rollup_hour``, the ragged edges from ``probe_rollup_minute``.
+        Raw probe rows are never read.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT rolled_up_to FROM rollup_watermarks WHERE name = 'hour'")
+            row = cursor.fetchone()
+            hour_watermark = row[0] if row else None
+
+            first_full_hour = start.replace(minute=0, second=0, microsecond=0)
+            if first_full_hour < start:
+                first_full_hour += datetime.timedelta(hours=1)
+
+            if hour_watermark is None or hour_watermark <= first_full_hour:
+                cursor.execute("""
+                    SELECT probe_count, success_count, latency_histogram, covered_seconds, up_seconds FROM probe_rollup_minute
+                    WHERE app_name = %s AND bucket >= %s
+                """, [app_name, start])
+            else:
+                cursor.execute("""
+                    SELECT probe_count, success_count, latency_histogram, covered_seconds, up_seconds FROM probe_rollup_minute
+                    WHERE app_name = %s AND ((bucket >= %s AND bucket < %s) OR bucket >= %s)
+                    UNION ALL
+                    SELECT probe_count, success_count, latency_histogram, covered_seconds, up_seconds FROM probe_rollup_hour
+                    WHERE app_name = %s AND bucket >= %s AND bucket < %s
+                """, [app_name, start, first_full_hour, hour_watermark,
+                      app_name, first_full_hour, hour_watermark])
+
+            myresult = cursor.fetchall()
+            cursor.close()
+        return myresult
+
+    def listen(self):
+        """Open a dedicated connection LISTENing on ``HEALTH_CHANNEL``.
+
+        It stays outside the pool: a listening session has to stay open and
+        only receives notifications while it is connected.
+        """
+        conn = psycopg2.connect(self.conn_string)
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"LISTEN {HEALTH_CHANNEL}")
+        cursor.close()
+        return conn
+
+    def states_snapshot(self, conn):
+        """Every states row as a dict, read on ``conn`` (the listening connection)."""
+        cursor = conn.cursor()
         cursor.execute("SELECT * FROM states")
+        columns = [column.name for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        cursor.close()
+        return rows
+
+    def current_state(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM states")
 
-        myresult = cursor.fetchall()
+            myresult = cursor.fetchall()
+            cursor.close()
 
         return myresult
 
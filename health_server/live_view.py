@@ -0,0 +1,135 @@
+import datetime
+import itertools
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Set HEALTH_VIEW_ENABLED=false to answer every request from the database again
+HEALTH_VIEW_ENABLED = os.environ.get("HEALTH_VIEW_ENABLED", "true").lower() == "true"
+# Events a slow stream subscriber may fall behind by before it is disconnected
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("SUBSCRIBER_QUEUE_SIZE", "1000"))
+LISTEN_RETRY_SECONDS = 5
+# How often an idle listening connection is checked for being alive
+LISTEN_PING_SECONDS = 30
+TIMESTAMP_COLUMNS = ("last_failure", "last_success", "created_at")
+
+
+class Subscriber:
+    def __init__(self, app_names=None):
+        self.app_names = set(app_names) if app_names else None
+        self.events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, app_name):
+        return self.app_names is None or app_name in self.app_names
+
+
+class HealthView:
+    """In-memory copy of the ``states`` table, kept current by the checker's notifications.
+
+    A background thread LISTENs on the health channel, then loads every row,
+    then applies each notification as it arrives, so the view is never more
+    than a notification behind the database.  Health transitions are handed
+    to every ``Subscriber``.  After losing the connection the thread
+    reconnects and reloads, since notifications sent meanwhile are lost.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.states = {}
+        self.subscribers = set()
+        self.event_ids = itertools.count(1)
+        self.synced = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.run, name="health-listener", daemon=True).start()
+
+    def get(self, app_name):
+        with self.lock:
+            return self.states.get(app_name)
+
+    def subscribe(self, app_names=None):
+        subscriber = Subscriber(app_names)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                # LISTEN before reading the snapshot so no update can fall in between
+                conn = self.db.listen()
+                snapshot = self.db.states_snapshot(conn)
+                with self.lock:
+                    self.states = {row["app_name"]: row for row in snapshot}
+                self.synced.set()
+                logger.info(f"Health view loaded {len(snapshot)} apps, following updates")
+                self.consume(conn)
+            except Exception as e:
+                self.synced.clear()
+                logger.warning(f"Health view lost its database connection: {e}")
+                time.sleep(LISTEN_RETRY_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def consume(self, conn):
+        while True:
+            if select.select([conn], [], [], LISTEN_PING_SECONDS) == ([], [], []):
+                # Nothing for a while, make sure the connection is still there
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+            conn.poll()
+            while conn.notifies:
+                self.apply(json.loads(conn.notifies.pop(0).payload))
+
+    def apply(self, payload):
+        state = dict(payload["state"])
+        for column in TIMESTAMP_COLUMNS:
+            if state.get(column):
+                state[column] = datetime.datetime.fromisoformat(state[column])
+
+        app_name = state["app_name"]
+        with self.lock:
+            current = self.states.get(app_name)
+            # Updates queued before the snapshot was read can be older than it;
+            # every update adds probes, so the older one has fewer
+            if current is not None and probe_count(current) > probe_count(state):
+                return
+            self.states[app_name] = state
+            subscribers = [s for s in self.subscribers if s.wants(app_name)]
+
+        if state.get("healthy") == payload.get("previous_healthy"):
+            return
+        changed_at = payload["state"]["last_success" if state.get("healthy") else "last_failure"]
+        event = (next(self.event_ids), {
+            "app_name": app_name,
+            "healthy": state.get("healthy"),
+            "previous_healthy": payload.get("previous_healthy"),
+            "changed_at": changed_at,
+            "success_count": state["success_count"],
+            "failure_count": state["failure_count"],
+        })
+        for subscriber in subscribers:
+            try:
+                subscriber.events.put_nowait(event)
+            except queue.Full:
+                subscriber.overflowed = True
+                self.unsubscribe(subscriber)
+
+
+def probe_count(state):
+    return (state.get("success_count") or 0) + (state.get("failure_count") or 0)
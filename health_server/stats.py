@@ -0,0 +1,64 @@
+import datetime
+import os
+import re
+
+# Upper bounds (ms) of the latency histogram buckets, must match
+# LATENCY_BUCKETS_MS in health_checker/rollup.py
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Longest ?window= accepted; hour rollups are kept indefinitely, but a window must stay a valid timedelta
+MAX_WINDOW_DAYS = int(os.environ.get("MAX_WINDOW_DAYS", "366"))
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_window(value):
+    """Parse a window like ``90s``, ``30m``, ``24h`` or ``7d`` into a timedelta."""
+    match = re.fullmatch(r"(\d+)([smhdw]?)", value.strip())
+    if not match:
+        raise ValueError(f"Invalid window '{value}', expected e.g. 30m, 24h or 7d")
+    amount, unit = match.groups()
+    seconds = int(amount) * WINDOW_UNITS[unit or "s"]
+    if seconds > MAX_WINDOW_DAYS * WINDOW_UNITS["d"]:
+        raise ValueError(f"Window '{value}' is longer than the maximum of {MAX_WINDOW_DAYS}d")
+    return datetime.timedelta(seconds=seconds)
+
+
+def merge_rollups(rows):
+    """Fold (probe_count, success_count, latency_histogram, covered_seconds, up_seconds) rows into one total."""
+    probe_count = 0
+    success_count = 0
+    histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    covered_seconds = 0.0
+    up_seconds = 0.0
+    for count, successes, row_histogram, covered, up in rows:
+        probe_count += count
+        success_count += successes
+        histogram = [a + b for a, b in zip(histogram, row_histogram)]
+        covered_seconds += covered
+        up_seconds += up
+    return probe_count, success_count, histogram, covered_seconds, up_seconds
+
+
+def histogram_percentile(histogram, percentile):
+    """Estimate a latency percentile (ms) from bucket counts.
+
+    Index ``i`` of the histogram counts latencies in
+    ``[LATENCY_BUCKETS_MS[i-1], LATENCY_BUCKETS_MS[i])``; the value is
+    interpolated linearly inside the bucket that holds the percentile.
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+    rank = percentile / 100 * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0
+            if i >= len(LATENCY_BUCKETS_MS):
+                # Open-ended overflow bucket, all we know is the lower bound
+                return float(lower)
+            upper = LATENCY_BUCKETS_MS[i]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return float(LATENCY_BUCKETS_MS[-1])